@@ -0,0 +1,245 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from trdi_adcp_readers.columnar import (
+    column_layout,
+    pack_columns,
+    padding,
+    unpack_columns
+)
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_MAGIC = b'TRDC'
+CACHE_VERSION = 2
+CACHE_SUFFIX = '.columns'
+
+DEFAULT_MAX_SIZE = 1 << 30
+
+# Temporary files older than this (in seconds) were left by a writer
+# that was killed before renaming them
+STALE_TEMP_AGE = 3600
+
+
+def _remove(path):
+    """
+    Removes a file that another process sharing the cache may already
+    have removed
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ColumnCache(object):
+    """
+    On-disk cache of decoded columns (as returned by pd0_to_columns).
+
+    Entries are keyed by the absolute path, size and modification time of
+    the source file plus, when hash_content is True, a hash of its
+    contents.  Each entry is a single file holding a small JSON header
+    followed by the raw column arrays, which are memory mapped on a hit
+    instead of being copied.  Once the cache grows past max_size bytes
+    the least recently used entries are removed.
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE,
+                 hash_content=True):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hash_content = hash_content
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path, variant=''):
+        """
+        Returns the cache key for a source file.  variant distinguishes
+        entries decoded from the same file with different options.
+        """
+        stat = os.stat(path)
+        key_hash = hashlib.blake2b(digest_size=20)
+        key_hash.update(json.dumps([
+            os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+            str(variant), CACHE_VERSION
+        ]).encode('utf-8'))
+        if self.hash_content:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    key_hash.update(chunk)
+        return key_hash.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def get(self, path, variant=''):
+        """
+        Returns memory mapped columns for a source file or None when the
+        file is not cached.
+        """
+        return self.load(self.key(path, variant))
+
+    def put(self, path, columns, variant=''):
+        """
+        Stores columns decoded from a source file and evicts old entries
+        if the cache is over its size limit.
+        """
+        self.store(self.key(path, variant), columns)
+
+    def load(self, key):
+        entry_path = self.entry_path(key)
+        try:
+            columns = load_columns(entry_path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError,
+                struct.error) as e:
+            # Truncated or written by an incompatible version
+            logger.warning('Discarding unreadable cache entry %s: %s',
+                           entry_path, e)
+            _remove(entry_path)
+            return None
+
+        # Touch the entry so eviction removes least recently used first.
+        # It stays mapped even if another process evicts it meanwhile.
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        return columns
+
+    def store(self, key, columns):
+        entry_path = self.entry_path(key)
+        # A unique temporary file keeps processes storing the same key
+        # from writing over each other before the atomic rename
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            save_columns(temp_path, columns)
+            os.replace(temp_path, entry_path)
+        except BaseException:
+            _remove(temp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        """
+        Returns (mtime, size, path) tuples for every entry in the cache.
+        Entries removed by another process while listing are skipped.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_SUFFIX):
+                entry_path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(entry_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry_path))
+        return entries
+
+    def remove_stale_temporary_files(self, age=STALE_TEMP_AGE):
+        """
+        Removes temporary files older than age seconds, which a writer
+        killed before renaming them leaves behind
+        """
+        cutoff = time.time() - age
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                temp_path = os.path.join(self.cache_dir, name)
+                try:
+                    stale = os.stat(temp_path).st_mtime < cutoff
+                except FileNotFoundError:
+                    continue
+                if stale:
+                    logger.debug('Removing stale temporary file %s',
+                                 temp_path)
+                    _remove(temp_path)
+
+    def evict(self):
+        """
+        Removes stale temporary files, then least recently used entries
+        until the cache fits within max_size.  Entries another process
+        removed first count as evicted.
+        """
+        self.remove_stale_temporary_files()
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total <= self.max_size:
+                break
+            logger.debug('Evicting cache entry %s', entry_path)
+            _remove(entry_path)
+            total -= size
+
+    def clear(self):
+        for _, _, entry_path in self.entries():
+            _remove(entry_path)
+
+
+def write_packed_header(f, magic, header):
+    """
+    Writes the magic bytes and JSON header that start a packed file.
+    The byte order is recorded and the header is padded so the packed
+    arrays that follow are aligned.
+    """
+    header = json.dumps(dict(header, byteorder=sys.byteorder))
+    header = header.encode('utf-8')
+    f.write(magic)
+    f.write(struct.pack('<I', len(header)))
+    f.write(header)
+    f.write(b'\x00' * padding(len(magic) + 4 + len(header)))
+
+
+def map_packed_file(path, magic):
+    """
+    Memory maps a file written with write_packed_header.
+
+    Returns the header and a read-only memoryview of the packed arrays
+    ('size' bytes) that follow it.
+    """
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapping)
+    if view[:len(magic)] != magic:
+        raise ValueError('%s does not start with %r' % (path, magic))
+    header_length = struct.unpack_from('<I', view, len(magic))[0]
+    header_start = len(magic) + 4
+    header = json.loads(
+        bytes(view[header_start:header_start + header_length])
+    )
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError('Byte order of %s does not match' % path)
+
+    data_start = header_start + header_length
+    data_start += padding(data_start)
+    return header, view[data_start:data_start + header['size']]
+
+
+def save_columns(path, columns):
+    """
+    Writes columns to path in the cache entry format
+    """
+    layout = column_layout(columns)
+    data = bytearray(layout['size'])
+    pack_columns(columns, data, layout)
+
+    with open(path, 'wb') as f:
+        write_packed_header(f, CACHE_MAGIC, layout)
+        f.write(data)
+
+
+def load_columns(path):
+    """
+    Memory maps a cache entry and returns its columns.  Profile and
+    variable leader columns are read-only memoryviews into the mapping.
+    """
+    header, data = map_packed_file(path, CACHE_MAGIC)
+    return unpack_columns(data, header)
@@ -0,0 +1,370 @@
+import struct
+import sys
+from array import array
+
+from trdi_adcp_readers.pd0.pd0_parser import (
+    output_data_parsers,
+    parse_address_offsets,
+    parse_fixed_leader,
+    parse_variable_leader
+)
+
+
+# Array type codes for the per cell per beam blocks
+profile_typecodes = {
+    'velocity': 'h',
+    'correlation': 'B',
+    'echo_intensity': 'B',
+    'percent_good': 'B',
+    'status': 'B'
+}
+
+# Value TRDI uses to flag a bad velocity
+BAD_VELOCITY = -32768
+
+# Bytes of the fixed leader covered by parse_fixed_leader
+FIXED_LEADER_SIZE = 59
+
+# Fixed leader fields kept for every ensemble, since a deployment may
+# change its configuration part way through
+configuration_fields = ('bin_1_distance', 'depth_cell_length')
+
+# Dictionaries of per ensemble columns
+column_groups = ('variable_leader', 'configuration')
+
+
+def ensembles_to_columns(ensembles):
+    """
+    Converts a sequence of parsed ensembles (as returned by
+    parse_pd0_bytearray) into columnar arrays.
+
+    Per cell per beam blocks are stored as flat array.array objects in
+    (ensemble, cell, beam) order.  Variable leader fields are stored as
+    one array per field.  All ensembles must share the number of cells
+    and beams of the first ensemble.  Only profile blocks present in
+    every ensemble are kept.  The fixed leader of the first ensemble is
+    kept whole and the configuration_fields of every ensemble are
+    stored as columns under 'configuration'.
+
+    Returns a dictionary of columns.
+    """
+    ensembles = list(ensembles)
+    if not ensembles:
+        raise ValueError('At least one ensemble is required')
+
+    fixed_leader = ensembles[0]['fixed_leader']
+    number_of_cells = fixed_leader['number_of_cells']
+    number_of_beams = fixed_leader['number_of_beams']
+
+    profiles = [key for key in profile_typecodes
+                if all(key in ensemble for ensemble in ensembles)]
+    columns = {
+        'number_of_ensembles': len(ensembles),
+        'number_of_cells': number_of_cells,
+        'number_of_beams': number_of_beams,
+        'fixed_leader': fixed_leader,
+        'variable_leader': {},
+        'configuration': {}
+    }
+    for key in profiles:
+        columns[key] = array(profile_typecodes[key])
+
+    variable_fields = ensembles[0]['variable_leader'].keys()
+    variable_columns = {field: [] for field in variable_fields}
+    configuration_columns = {field: [] for field in configuration_fields}
+    for ensemble in ensembles:
+        ensemble_fixed = ensemble['fixed_leader']
+        if (ensemble_fixed['number_of_cells'] != number_of_cells or
+                ensemble_fixed['number_of_beams'] != number_of_beams):
+            raise ValueError(
+                'Ensemble %d has a different cell/beam layout' %
+                ensemble['variable_leader']['ensemble_number']
+            )
+        for key in profiles:
+            column = columns[key]
+            for cell in ensemble[key]['data']:
+                column.extend(cell)
+        variable_leader = ensemble['variable_leader']
+        for field, values in variable_columns.items():
+            values.append(variable_leader[field])
+        for field, values in configuration_columns.items():
+            values.append(ensemble_fixed[field])
+
+    for field, values in variable_columns.items():
+        columns['variable_leader'][field] = array('q', values)
+    for field, values in configuration_columns.items():
+        columns['configuration'][field] = array('q', values)
+
+    return columns
+
+
+def pd0_to_columns(ensembles):
+    """
+    Decodes a sequence of raw PD0 ensembles (e.g. from
+    iter_ensemble_bytes) straight into columns.
+
+    Per cell per beam blocks are copied into the column arrays with
+    array.frombytes instead of unpacking every value.  The fixed leader
+    is only parsed again when its bytes change.  All ensembles must
+    share the cell/beam layout of the first one.
+
+    Returns a dictionary of columns in the same form as
+    ensembles_to_columns.
+    """
+    columns = None
+    fixed_leader_bytes = None
+    profile_ids = {}
+    variable_columns = {}
+    configuration_columns = {field: array('q')
+                             for field in configuration_fields}
+    number_of_ensembles = 0
+    for pd0_bytes in ensembles:
+        view = memoryview(pd0_bytes)
+        offsets = parse_address_offsets(view, view[5])
+        blocks = {struct.unpack_from('<H', view, offset)[0]: offset
+                  for offset in offsets}
+
+        fixed_offset = blocks[0x0000]
+        fixed_bytes = view[fixed_offset:fixed_offset + FIXED_LEADER_SIZE]
+        if fixed_bytes != fixed_leader_bytes:
+            fixed_leader = parse_fixed_leader(view, fixed_offset, None)
+            fixed_leader_bytes = bytes(fixed_bytes)
+            if columns is None:
+                number_of_cells = fixed_leader['number_of_cells']
+                number_of_beams = fixed_leader['number_of_beams']
+                columns = {
+                    'number_of_cells': number_of_cells,
+                    'number_of_beams': number_of_beams,
+                    'fixed_leader': fixed_leader,
+                    'variable_leader': {},
+                    'configuration': configuration_columns
+                }
+                for header_id in blocks:
+                    key = output_data_parsers.get(header_id, (None,))[0]
+                    if key in profile_typecodes:
+                        profile_ids[key] = header_id
+                        columns[key] = array(profile_typecodes[key])
+            elif (fixed_leader['number_of_cells'] != number_of_cells or
+                  fixed_leader['number_of_beams'] != number_of_beams):
+                raise ValueError(
+                    'Ensemble %d has a different cell/beam layout' %
+                    number_of_ensembles
+                )
+        for field, values in configuration_columns.items():
+            values.append(fixed_leader[field])
+
+        variable_offset = blocks[0x0080]
+        variable_end = min(
+            [offset for offset in offsets if offset > variable_offset] +
+            [struct.unpack_from('<H', view, 2)[0]]
+        )
+        variable_leader = parse_variable_leader(view[:variable_end],
+                                                variable_offset, {})
+        for field, value in variable_leader.items():
+            variable_columns.setdefault(field, []).append(value)
+
+        for key, header_id in profile_ids.items():
+            if header_id not in blocks:
+                raise ValueError('Ensemble %d has no %s block' %
+                                 (number_of_ensembles, key))
+            column = columns[key]
+            start = blocks[header_id] + 2
+            column.frombytes(view[start:start + number_of_cells *
+                                  number_of_beams * column.itemsize])
+        number_of_ensembles += 1
+
+    if columns is None:
+        raise ValueError('At least one ensemble is required')
+
+    if sys.byteorder == 'big':
+        for key in profile_typecodes:
+            if key in columns:
+                columns[key].byteswap()
+
+    columns['number_of_ensembles'] = number_of_ensembles
+    for field, values in variable_columns.items():
+        # Fields such as the Y2K clock are missing from the shorter
+        # variable leader of older firmware
+        if len(values) == number_of_ensembles:
+            columns['variable_leader'][field] = array('q', values)
+
+    return columns
+
+
+def concatenate_columns(parts):
+    """
+    Joins several sets of columns sharing one cell/beam layout into a
+    single set.  The fixed leader of the first set is kept; the
+    configuration columns hold that of every ensemble.
+    """
+    parts = list(parts)
+    if not parts:
+        raise ValueError('At least one set of columns is required')
+
+    first = parts[0]
+    columns = {
+        'number_of_ensembles': 0,
+        'number_of_cells': first['number_of_cells'],
+        'number_of_beams': first['number_of_beams'],
+        'fixed_leader': first['fixed_leader'],
+        'variable_leader': {},
+        'configuration': {}
+    }
+    for part in parts:
+        if (part['number_of_cells'] != columns['number_of_cells'] or
+                part['number_of_beams'] != columns['number_of_beams']):
+            raise ValueError('Columns have different cell/beam layouts')
+        columns['number_of_ensembles'] += part['number_of_ensembles']
+        for name, values in column_arrays(part):
+            if '/' in name:
+                group, name = name.split('/', 1)
+                target = columns[group]
+            else:
+                target = columns
+            if name not in target:
+                typecode = getattr(values, 'typecode', None) or values.format
+                target[name] = array(typecode)
+            target[name].extend(values)
+
+    return columns
+
+
+def configuration_column(columns, field):
+    """
+    Returns a configuration_fields value for every ensemble, taken from
+    the fixed leader for columns that have no configuration columns
+    """
+    values = columns.get('configuration', {}).get(field)
+    if values is None:
+        values = [columns['fixed_leader'][field]] * (
+            columns['number_of_ensembles']
+        )
+    return values
+
+
+def column_index(columns, ensemble, cell, beam=0):
+    """
+    Returns the flat index of an (ensemble, cell, beam) element
+    """
+    return ((ensemble * columns['number_of_cells'] + cell) *
+            columns['number_of_beams'] + beam)
+
+
+def ensemble_slice(columns, ensemble):
+    """
+    Returns the slice of a profile column holding a single ensemble
+    """
+    size = columns['number_of_cells'] * columns['number_of_beams']
+    return slice(ensemble * size, (ensemble + 1) * size)
+
+
+# Arrays are aligned so views into a shared buffer can be cast safely
+ALIGNMENT = 8
+
+
+def padding(size):
+    """
+    Returns the number of zero bytes that align an offset of size
+    """
+    return -size % ALIGNMENT
+
+
+def column_arrays(columns):
+    """
+    Yields (name, array) pairs for every profile, variable leader and
+    configuration column.  Names of the latter are prefixed with their
+    group, e.g. 'variable_leader/pitch'.
+    """
+    for key in profile_typecodes:
+        if key in columns:
+            yield key, columns[key]
+    for group in column_groups:
+        for field, values in columns.get(group, {}).items():
+            yield group + '/' + field, values
+
+
+def column_layout(columns):
+    """
+    Describes how the arrays of a set of columns are packed into a flat,
+    aligned buffer.
+
+    Returns a JSON and pickle friendly dictionary with the column shape,
+    fixed leader and the array_layout 'arrays' entries, plus a 'size'
+    key giving the buffer length in bytes.
+    """
+    arrays, size = array_layout(
+        (name, getattr(values, 'typecode', None) or values.format,
+         len(values))
+        for name, values in column_arrays(columns)
+    )
+    return {
+        'number_of_ensembles': columns['number_of_ensembles'],
+        'number_of_cells': columns['number_of_cells'],
+        'number_of_beams': columns['number_of_beams'],
+        'fixed_leader': columns['fixed_leader'],
+        'arrays': arrays,
+        'size': size
+    }
+
+
+def array_layout(arrays):
+    """
+    Places (name, typecode, count) arrays one after another in a flat
+    buffer, each starting on an ALIGNMENT boundary.
+
+    Returns a list of [name, typecode, offset, count] entries and the
+    buffer length in bytes.
+    """
+    entries = []
+    offset = 0
+    for name, typecode, count in arrays:
+        size = count * struct.calcsize(typecode)
+        entries.append([name, typecode, offset, count])
+        offset += size + padding(size)
+
+    return entries, offset
+
+
+def pack_columns(columns, buffer, layout):
+    """
+    Copies column arrays into a writable buffer following layout
+    """
+    view = memoryview(buffer).cast('B')
+    for (name, values), (_, _, offset, count) in zip(column_arrays(columns),
+                                                     layout['arrays']):
+        data = memoryview(values).cast('B')
+        view[offset:offset + len(data)] = data
+
+
+def unpack_columns(buffer, layout):
+    """
+    Returns columns whose arrays are memoryviews into buffer, which
+    must hold data packed according to layout.  No data is copied.
+    """
+    columns = {
+        'number_of_ensembles': layout['number_of_ensembles'],
+        'number_of_cells': layout['number_of_cells'],
+        'number_of_beams': layout['number_of_beams'],
+        'fixed_leader': layout['fixed_leader']
+    }
+    for group in column_groups:
+        columns[group] = {}
+    for name, values in unpack_arrays(buffer, layout['arrays']):
+        if '/' in name:
+            group, field = name.split('/', 1)
+            columns[group][field] = values
+        else:
+            columns[name] = values
+
+    return columns
+
+
+def unpack_arrays(buffer, entries):
+    """
+    Yields (name, memoryview) pairs for array_layout entries of a
+    buffer.  No data is copied.
+    """
+    view = memoryview(buffer).cast('B')
+    for name, typecode, offset, count in entries:
+        values = view[offset:offset + count * struct.calcsize(typecode)]
+        yield name, values.cast(typecode)
@@ -0,0 +1,60 @@
+import bz2
+import gzip
+import io
+import lzma
+from contextlib import contextmanager
+
+
+# Leading bytes identifying each supported compression format
+compression_magic = (
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open)
+)
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+def _peek(f, size):
+    if hasattr(f, 'peek'):
+        return f.peek(size)[:size]
+    elif f.seekable():
+        position = f.tell()
+        magic = f.read(size)
+        f.seek(position)
+        return magic
+    else:
+        # Without peek or seek the stream can only be read as is
+        return b''
+
+
+@contextmanager
+def open_binary(source, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Opens a path or binary file object for reading, transparently
+    decompressing gzip, bzip2 and xz data detected from its leading
+    bytes.
+
+    Decompressed data is streamed through a buffered reader holding at
+    most buffer_size bytes of read-ahead, so compressed archives never
+    need to be expanded to disk.  File objects passed in are not closed.
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, '__fspath__'):
+        f = open(source, 'rb')
+        owned = True
+    else:
+        f = source
+        owned = False
+
+    try:
+        magic = _peek(f, 6)
+        for prefix, decompressor in compression_magic:
+            if magic.startswith(prefix):
+                with decompressor(f, 'rb') as compressed:
+                    yield io.BufferedReader(compressed, buffer_size)
+                break
+        else:
+            yield f
+    finally:
+        if owned:
+            f.close()
@@ -0,0 +1,83 @@
+import heapq
+import logging
+
+from trdi_adcp_readers.pd0.pd0_stream import raw_ensemble_counter
+from trdi_adcp_readers.readers import iter_PD0_file
+
+logger = logging.getLogger(__name__)
+
+
+merge_keys = {
+    'timestamp': lambda data, pd0_bytes: data['timestamp'],
+    'ensemble': lambda data, pd0_bytes: raw_ensemble_counter(pd0_bytes)
+}
+
+
+def _push_next(heap, iterator, index, key_function):
+    for data, pd0_bytes in iterator:
+        heapq.heappush(heap, (key_function(data, pd0_bytes), index, data,
+                              pd0_bytes, iterator))
+        return
+
+
+def merge_ensemble_streams(streams, key='timestamp', deduplicate=True):
+    """
+    Merges several time ordered ensemble streams into one ordered stream.
+
+    Each stream is an iterable of (data, pd0_bytes) tuples such as
+    iter_PD0_file(path, return_pd0=True).  Only the head of each stream
+    is held in memory.  key is 'timestamp' or 'ensemble' (the ensemble
+    number extended by the roll over byte).  Ties are yielded in stream
+    order.
+
+    When deduplicate is True an ensemble whose ensemble number and
+    checksum match one already yielded with the same key is dropped.
+
+    Yields (data, pd0_bytes) tuples.
+    """
+    key_function = merge_keys[key]
+    heap = []
+    for index, stream in enumerate(streams):
+        _push_next(heap, iter(stream), index, key_function)
+
+    last_key = None
+    seen = set()
+    duplicates = 0
+    while heap:
+        sort_key, index, data, pd0_bytes, iterator = heapq.heappop(heap)
+        _push_next(heap, iterator, index, key_function)
+
+        if deduplicate:
+            # Duplicates share a key so only the current key is tracked
+            if sort_key != last_key:
+                last_key = sort_key
+                seen.clear()
+            identity = (raw_ensemble_counter(pd0_bytes),
+                        bytes(pd0_bytes[-2:]))
+            if identity in seen:
+                duplicates += 1
+                continue
+            seen.add(identity)
+
+        yield data, pd0_bytes
+
+    if duplicates:
+        logger.info('Dropped %d duplicate ensembles while merging',
+                    duplicates)
+
+
+def merge_PD0_files(paths, key='timestamp', header_lines=0,
+                    deduplicate=True, return_pd0=False):
+    """
+    Lazily merges the ensembles of several PD0 files by timestamp or
+    ensemble number.  Files are read in chunks, so memory is bounded by
+    the number of files rather than their size.
+    """
+    streams = [iter_PD0_file(path, header_lines, return_pd0=True)
+               for path in paths]
+    for data, pd0_bytes in merge_ensemble_streams(streams, key,
+                                                  deduplicate):
+        if return_pd0:
+            yield data, pd0_bytes
+        else:
+            yield data
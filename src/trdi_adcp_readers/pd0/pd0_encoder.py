@@ -0,0 +1,190 @@
+import struct
+import sys
+from array import array
+
+from trdi_adcp_readers.columnar import FIXED_LEADER_SIZE, profile_typecodes
+from trdi_adcp_readers.pd0.pd0_parser import (
+    fixed_leader_format,
+    variable_leader_format
+)
+
+
+VARIABLE_LEADER_SIZE = 65
+
+# Reserved bytes ahead of the checksum, counted in number_of_bytes
+RESERVED_SIZE = 2
+
+profile_ids = {
+    'velocity': 0x0100,
+    'correlation': 0x0200,
+    'echo_intensity': 0x0300,
+    'percent_good': 0x0400,
+    'status': 0x0500
+}
+
+
+def block_struct(format_tuples, size):
+    """
+    Compiles parser format tuples into a struct.Struct packing a whole
+    block of size bytes.  Bytes not covered by a field are zero filled.
+
+    Returns the Struct and the field names in packing order.
+    """
+    fmt = '<'
+    names = []
+    position = 0
+    for name, field_format, offset in sorted(format_tuples,
+                                             key=lambda f: f[2]):
+        if offset > position:
+            fmt += '%dx' % (offset - position)
+        fmt += field_format.lstrip('<')
+        names.append(name)
+        position = offset + struct.calcsize(field_format)
+    if size > position:
+        fmt += '%dx' % (size - position)
+
+    return struct.Struct(fmt), names
+
+
+fixed_leader_struct, fixed_leader_names = block_struct(
+    fixed_leader_format, FIXED_LEADER_SIZE
+)
+variable_leader_struct, variable_leader_names = block_struct(
+    variable_leader_format, VARIABLE_LEADER_SIZE
+)
+
+
+def _profile_bytes(typecode, values):
+    data = array(typecode, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _ensemble_template(block_sizes, data_source=0x7f, spare=0):
+    """
+    Returns a zeroed ensemble with the fixed header and address offsets
+    filled in, plus the offset of each block.
+    """
+    header_size = 6 + 2 * len(block_sizes)
+    offsets = []
+    position = header_size
+    for size in block_sizes:
+        offsets.append(position)
+        position += size
+    number_of_bytes = position + RESERVED_SIZE
+
+    template = bytearray(number_of_bytes + 2)
+    struct.pack_into('<BBHBB', template, 0, 0x7f, data_source,
+                     number_of_bytes, spare, len(block_sizes))
+    struct.pack_into('<%dH' % len(offsets), template, 6, *offsets)
+    return template, offsets
+
+
+def _set_checksum(pd0_bytes):
+    number_of_bytes = len(pd0_bytes) - 2
+    struct.pack_into('<H', pd0_bytes, number_of_bytes,
+                     sum(memoryview(pd0_bytes)[:number_of_bytes]) & 0xFFFF)
+
+
+def encode_pd0_ensemble(data):
+    """
+    Serializes a parsed ensemble (as returned by parse_pd0_bytearray)
+    back into a PD0 ensemble with address offsets and checksum.
+
+    Fields the parser does not decode are written as zeros, so the
+    result parses back to the same values but is not necessarily byte
+    for byte identical to the original.
+
+    Returns a bytearray.
+    """
+    fixed_leader = data['fixed_leader']
+    variable_leader = data['variable_leader']
+    blocks = [
+        fixed_leader_struct.pack(*[
+            fixed_leader.get(name, 0) for name in fixed_leader_names
+        ]),
+        variable_leader_struct.pack(*[
+            variable_leader.get(name, 0) for name in variable_leader_names
+        ])
+    ]
+    for key, header_id in profile_ids.items():
+        if key in data:
+            blocks.append(
+                struct.pack('<H', header_id) +
+                _profile_bytes(profile_typecodes[key],
+                               [value for cell in data[key]['data']
+                                for value in cell])
+            )
+
+    header = data.get('header', {})
+    pd0_bytes, offsets = _ensemble_template(
+        [len(block) for block in blocks],
+        header.get('data_source', 0x7f), header.get('spare', 0)
+    )
+    for offset, block in zip(offsets, blocks):
+        pd0_bytes[offset:offset + len(block)] = block
+    # The parsers read the block IDs, so make sure they are set
+    struct.pack_into('<H', pd0_bytes, offsets[0], 0x0000)
+    struct.pack_into('<H', pd0_bytes, offsets[1], 0x0080)
+    _set_checksum(pd0_bytes)
+    return pd0_bytes
+
+
+def iter_encode_columns(columns):
+    """
+    Serializes every ensemble of a set of columns (as returned by
+    ensembles_to_columns or pd0_to_columns) into PD0.
+
+    The header, address offsets and fixed leader are built once; each
+    ensemble only packs its variable leader and configuration fields,
+    copies its slice of every profile column and updates the checksum.
+
+    Yields one bytearray per ensemble.
+    """
+    number_of_ensembles = columns['number_of_ensembles']
+    values_per_ensemble = (columns['number_of_cells'] *
+                           columns['number_of_beams'])
+
+    profiles = []
+    for key, header_id in profile_ids.items():
+        if key in columns:
+            data = _profile_bytes(profile_typecodes[key], columns[key])
+            profiles.append((header_id, data,
+                             len(data) // max(1, number_of_ensembles)))
+
+    block_sizes = ([FIXED_LEADER_SIZE, VARIABLE_LEADER_SIZE] +
+                   [2 + size for _, _, size in profiles])
+    template, offsets = _ensemble_template(block_sizes)
+    fixed_leader = dict(columns['fixed_leader'], id=0x0000)
+    fixed_leader_struct.pack_into(template, offsets[0], *[
+        fixed_leader.get(name, 0) for name in fixed_leader_names
+    ])
+    for (header_id, _, _), offset in zip(profiles, offsets[2:]):
+        struct.pack_into('<H', template, offset, header_id)
+
+    variable_columns = columns['variable_leader']
+    zeros = [0] * number_of_ensembles
+    variable_rows = zip(*[
+        [0x0080] * number_of_ensembles if name == 'id'
+        else variable_columns.get(name, zeros)
+        for name in variable_leader_names
+    ])
+    configuration = [
+        (fmt[1], offsets[0] + fmt[2], columns['configuration'][fmt[0]])
+        for fmt in fixed_leader_format
+        if fmt[0] in columns.get('configuration', {})
+    ]
+    variable_offset = offsets[1]
+    for ensemble, variable_values in enumerate(variable_rows):
+        pd0_bytes = bytearray(template)
+        for field_format, offset, values in configuration:
+            struct.pack_into(field_format, pd0_bytes, offset,
+                             values[ensemble])
+        variable_leader_struct.pack_into(pd0_bytes, variable_offset,
+                                         *variable_values)
+        for (_, data, size), offset in zip(profiles, offsets[2:]):
+            start = ensemble * size
+            pd0_bytes[offset + 2:offset + 2 + size] = data[start:start + size]
+        _set_checksum(pd0_bytes)
+        yield pd0_bytes
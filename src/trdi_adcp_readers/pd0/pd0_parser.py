@@ -1,34 +1,237 @@
+import logging
 import struct
+from collections import Counter
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
 
-def unpack_bytes(pd0_bytes, data_format_tuples, offset=0):
+
+class ParseDiagnostics(object):
+    """
+    Aggregates anomalies found while parsing PD0 ensembles.
+
+    The first occurrence of each anomaly is logged at WARNING level.
+    Repeats only increment a counter so that files with a systematic
+    problem (e.g. an unsupported block in every ensemble) do not flood
+    the log.  Call log_summary() to report the totals.
+    """
+    def __init__(self):
+        self.field_errors = Counter()
+        self.unknown_blocks = Counter()
+        self.skipped_bytes = Counter()
+
+    def field_error(self, block, field, fmt, offset, size):
+        key = (block, field)
+        if key not in self.field_errors:
+            logger.warning('Error parsing %s.%s with the arguments %s, '
+                           'offset:%d size:%d', block, field, fmt,
+                           offset, size)
+        self.field_errors[key] += 1
+
+    def unknown_block(self, header_id, size):
+        if header_id not in self.unknown_blocks:
+            logger.warning('No parser found for header 0x%04X, '
+                           'skipping %d bytes', header_id, size)
+        self.unknown_blocks[header_id] += 1
+        self.skipped_bytes[header_id] += size
+
+    def reset(self):
+        self.field_errors.clear()
+        self.unknown_blocks.clear()
+        self.skipped_bytes.clear()
+
+    def summary(self):
+        """
+        Returns a dictionary of anomaly counts keyed by block and field
+        or by unknown block ID.
+        """
+        return {
+            'field_errors': dict(self.field_errors),
+            'unknown_blocks': dict(self.unknown_blocks),
+            'skipped_bytes': dict(self.skipped_bytes)
+        }
+
+    def log_summary(self, level=logging.INFO, source=None):
+        """
+        Logs the anomaly totals.  source (e.g. the input file name)
+        prefixes each message when given.
+        """
+        prefix = '%s: ' % source if source else ''
+        for (block, field), count in sorted(self.field_errors.items(),
+                                            key=str):
+            logger.log(level, '%sField %s.%s failed to parse %d times',
+                       prefix, block, field, count)
+        for header_id, count in sorted(self.unknown_blocks.items()):
+            logger.log(level, '%sSkipped unknown block 0x%04X %d times '
+                       '(%d bytes)', prefix, header_id, count,
+                       self.skipped_bytes[header_id])
+
+
+# Collector shared by all of the parsers
+diagnostics = ParseDiagnostics()
+
+
+# (field name, struct format, offset within the block) tuples
+header_data_format = (
+    ('id', 'B', 0),
+    ('data_source', 'B', 1),
+    ('number_of_bytes', '<H', 2),
+    ('spare', 'B', 4),
+    ('number_of_data_types', 'B', 5)
+)
+
+
+fixed_leader_format = (
+    ('id', '<H', 0),
+    ('cpu_firmware_version', 'B', 2),
+    ('cpu_firmware_revision', 'B', 3),
+    ('system_configuration', 'B', 5),
+    ('simulation_data_flag', 'B', 6),
+    ('lag_length', 'B', 7),
+    ('number_of_beams', 'B', 8),
+    ('number_of_cells', 'B', 9),
+    ('pings_per_ensemble', '<H', 10),
+    ('depth_cell_length', '<H', 12),
+    ('blank_after_transmit', '<H', 14),
+    ('signal_processing_mode', 'B', 16),
+    ('low_correlation_threshold', 'B', 17),
+    ('number_of_code_repetitions', 'B', 18),
+    ('minimum_percentage_water_profile_pings', 'B', 19),
+    ('error_velocity_threshold', '<H', 20),
+    ('minutes', 'B', 22),
+    ('seconds', 'B', 23),
+    ('hundredths', 'B', 24),
+    ('coordinate_transformation_process', 'B', 25),
+    ('heading_alignment', '<H', 26),
+    ('heading_bias', '<H', 28),
+    ('sensor_source', 'B', 30),
+    ('sensor_available', 'B', 31),
+    ('bin_1_distance', '<H', 32),
+    ('transmit_pulse_length', '<H', 34),
+    ('starting_depth_cell', 'B', 36),
+    ('ending_depth_cell', 'B', 37),
+    ('false_target_threshold', 'B', 38),
+    ('spare', 'B', 39),
+    ('transmit_lag_distance', '<H', 40),
+    ('cpu_board_serial_number', '<Q', 42),
+    ('system_bandwidth', '<H', 50),
+    ('system_power', 'B', 52),
+    ('spare', 'B', 53),
+    ('serial_number', '<I', 54),
+    ('beam_angle', 'B', 58)
+)
+
+
+variable_leader_format = (
+    ('id', '<H', 0),
+    ('ensemble_number', '<H', 2),
+    ('rtc_year', 'B', 4),
+    ('rtc_month', 'B', 5),
+    ('rtc_day', 'B', 6),
+    ('rtc_hour', 'B', 7),
+    ('rtc_minute', 'B', 8),
+    ('rtc_second', 'B', 9),
+    ('rtc_hundredths', 'B', 10),
+    ('ensemble_roll_over', 'B', 11),
+    ('bit_result', '<H', 12),
+    ('speed_of_sound', '<H', 14),
+    ('depth_of_transducer', '<H', 16),
+    ('heading', '<H', 18),
+    ('pitch', '<h', 20),
+    ('roll', '<h', 22),
+    ('salinity', '<H', 24),
+    ('temperature', '<h', 26),
+    ('mpt_minutes', 'B', 28),
+    ('mpt_seconds', 'B', 29),
+    ('mpt_hundredths', 'B', 30),
+    ('heading_standard_deviation', 'B', 31),
+    ('pitch_standard_deviation', 'B', 32),
+    ('roll_standard_deviation', 'B', 33),
+    ('transmit_current', 'B', 34),
+    ('transmit_voltage', 'B', 35),
+    ('ambient_temperature', 'B', 36),
+    ('pressure_positive', 'B', 37),
+    ('pressure_negative', 'B', 38),
+    ('attitude_temperature', 'B', 39),
+    ('attitude', 'B', 40),
+    ('contamination_sensor', 'B', 41),
+    ('error_status_word', '<I', 42),
+    ('reserved', '<H', 46),
+    ('pressure', '<I', 48),
+    ('pressure_variance', '<I', 52),
+    ('spare', 'B', 56),
+    ('rtc_y2k_century', 'B', 57),
+    ('rtc_y2k_year', 'B', 58),
+    ('rtc_y2k_month', 'B', 59),
+    ('rtc_y2k_day', 'B', 60),
+    ('rtc_y2k_hour', 'B', 61),
+    ('rtc_y2k_minute', 'B', 62),
+    ('rtc_y2k_seconds', 'B', 63),
+    ('rtc_y2k_hundredths', 'B', 64)
+)
+
+
+clock_fields = tuple(fmt[0] for fmt in variable_leader_format
+                     if fmt[0].startswith('rtc_'))
+
+
+def ensemble_clock(variable_data):
+    """
+    Returns the year, month, day, hour, minute, second and hundredths of
+    an ensemble from its variable leader fields.
+
+    The Y2K clock fields that follow the pressure data are preferred
+    when present; otherwise the two digit rtc_year is assumed to be in
+    the 2000s.
+    """
+    if variable_data.get('rtc_y2k_century'):
+        return (variable_data['rtc_y2k_century'] * 100 +
+                variable_data['rtc_y2k_year'],
+                variable_data['rtc_y2k_month'],
+                variable_data['rtc_y2k_day'],
+                variable_data['rtc_y2k_hour'],
+                variable_data['rtc_y2k_minute'],
+                variable_data['rtc_y2k_seconds'],
+                variable_data['rtc_y2k_hundredths'])
+    return (variable_data['rtc_year'] + 2000,
+            variable_data['rtc_month'],
+            variable_data['rtc_day'],
+            variable_data['rtc_hour'],
+            variable_data['rtc_minute'],
+            variable_data['rtc_second'],
+            variable_data['rtc_hundredths'])
+
+
+def ensemble_datetime(variable_data):
+    """
+    Returns the ensemble_clock of an ensemble as a datetime
+    """
+    year, month, day, hour, minute, second, hundredths = (
+        ensemble_clock(variable_data)
+    )
+    return datetime(year, month, day, hour, minute, second,
+                    hundredths * 10000)
+
+
+def unpack_bytes(pd0_bytes, data_format_tuples, offset=0, block=None):
     data = {}
+    view = memoryview(pd0_bytes)
     for fmt in data_format_tuples:
+        struct_offset = offset+fmt[2]
+        size = struct.calcsize(fmt[1])
         try:
-            struct_offset = offset+fmt[2]
-            size = struct.calcsize(fmt[1])
-            data_bytes = memoryview(pd0_bytes)[struct_offset:struct_offset + size]
             data[fmt[0]] = (
-                struct.unpack(fmt[1], data_bytes)[0]
+                struct.unpack_from(fmt[1], view, struct_offset)[0]
             )
-        except Exception as e:
-            print(f'Error parsing {fmt[0]} with the arguments '
-                  f'{fmt[1]}, offset:{struct_offset} size:{size}')
+        except struct.error:
+            diagnostics.field_error(block, fmt[0], fmt[1],
+                                    struct_offset, size)
 
     return data
 
 
 def parse_fixed_header(pd0_bytes):
-    header_data_format = (
-        ('id', 'B', 0),
-        ('data_source', 'B', 1),
-        ('number_of_bytes', '<H', 2),
-        ('spare', 'B', 4),
-        ('number_of_data_types', 'B', 5)
-    )
-
-    return unpack_bytes(pd0_bytes, header_data_format)
+    return unpack_bytes(pd0_bytes, header_data_format, block='header')
 
 
 def parse_address_offsets(pd0_bytes, num_datatypes, offset=6):
@@ -44,108 +247,19 @@ def parse_address_offsets(pd0_bytes, num_datatypes, offset=6):
 
 
 def parse_fixed_leader(pd0_bytes, offset, data):
-    fixed_leader_format = (
-        ('id', '<H', 0),
-        ('cpu_firmware_version', 'B', 2),
-        ('cpu_firmware_revision', 'B', 3),
-        ('system_configuration', 'B', 5),
-        ('simulation_data_flag', 'B', 6),
-        ('lag_length', 'B', 7),
-        ('number_of_beams', 'B', 8),
-        ('number_of_cells', 'B', 9),
-        ('pings_per_ensemble', '<H', 10),
-        ('depth_cell_length', '<H', 12),
-        ('blank_after_transmit', '<H', 14),
-        ('signal_processing_mode', 'B', 16),
-        ('low_correlation_threshold', 'B', 17),
-        ('number_of_code_repetitions', 'B', 18),
-        ('minimum_percentage_water_profile_pings', 'B', 19),
-        ('error_velocity_threshold', '<H', 20),
-        ('minutes', 'B', 22),
-        ('seconds', 'B', 23),
-        ('hundredths', 'B', 24),
-        ('coordinate_transformation_process', 'B', 25),
-        ('heading_alignment', '<H', 26),
-        ('heading_bias', '<H', 28),
-        ('sensor_source', 'B', 30),
-        ('sensor_available', 'B', 31),
-        ('bin_1_distance', '<H', 32),
-        ('transmit_pulse_length', '<H', 34),
-        ('starting_depth_cell', 'B', 36),
-        ('ending_depth_cell', 'B', 37),
-        ('false_target_threshold', 'B', 38),
-        ('spare', 'B', 39),
-        ('transmit_lag_distance', '<H', 40),
-        ('cpu_board_serial_number', '<Q', 42),
-        ('system_bandwidth', '<H', 50),
-        ('system_power', 'B', 52),
-        ('spare', 'B', 53),
-        ('serial_number', '<I', 54),
-        ('beam_angle', 'B', 58)
-    )
-
-    return unpack_bytes(pd0_bytes, fixed_leader_format, offset)
+    return unpack_bytes(pd0_bytes, fixed_leader_format, offset,
+                        block='fixed_leader')
 
 
 def parse_variable_leader(pd0_bytes, offset, data):
-    variable_leader_format = (
-        ('id', '<H', 0),
-        ('ensemble_number', '<H', 2),
-        ('rtc_year', 'B', 4),
-        ('rtc_month', 'B', 5),
-        ('rtc_day', 'B', 6),
-        ('rtc_hour', 'B', 7),
-        ('rtc_minute', 'B', 8),
-        ('rtc_second', 'B', 9),
-        ('rtc_hundredths', 'B', 10),
-        ('ensemble_roll_over', 'B', 11),
-        ('bit_result', '<H', 12),
-        ('speed_of_sound', '<H', 14),
-        ('depth_of_transducer', '<H', 16),
-        ('heading', '<H', 18),
-        ('pitch', '<h', 20),
-        ('roll', '<h', 22),
-        ('salinity', '<H', 24),
-        ('temperature', '<h', 26),
-        ('mpt_minutes', 'B', 28),
-        ('mpt_seconds', 'B', 29),
-        ('mpt_hundredths', 'B', 30),
-        ('heading_standard_deviation', 'B', 31),
-        ('pitch_standard_deviation', 'B', 32),
-        ('roll_standard_deviation', 'B', 33),
-        ('transmit_current', 'B', 34),
-        ('transmit_voltage', 'B', 35),
-        ('ambient_temperature', 'B', 36),
-        ('pressure_positive', 'B', 37),
-        ('pressure_negative', 'B', 38),
-        ('attitude_temperature', 'B', 39),
-        ('attitude', 'B', 40),
-        ('contamination_sensor', 'B', 41),
-        ('error_status_word', '<I', 42),
-        ('reserved', '<H', 46),
-        ('pressure', '<I', 48),
-        ('pressure_variance', '<I', 52),
-        ('spare', 'B', 56),
-        ('rtc_y2k_century', 'B', 57),
-        ('rtc_y2k_year', 'B', 58),
-        ('rtc_y2k_month', 'B', 59),
-        ('rtc_y2k_day', 'B', 60),
-        ('rtc_y2k_hour', 'B', 61),
-        ('rtc_y2k_minute', 'B', 62),
-        ('rtc_y2k_seconds', 'B', 63),
-        ('rtc_y2k_hundredths', 'B', 64)
-    )
-
-    variable_data = unpack_bytes(pd0_bytes, variable_leader_format, offset)
-    data['timestamp'] = datetime(
-        variable_data['rtc_year'] + 2000,
-        variable_data['rtc_month'],
-        variable_data['rtc_day'],
-        variable_data['rtc_hour'],
-        variable_data['rtc_minute'],
-        variable_data['rtc_second'],
-        variable_data['rtc_hundredths']
-    )
+    # pd0_bytes ends with the block, so older firmware that stops before
+    # the Y2K clock fields does not read into the next block
+    size = len(pd0_bytes) - offset
+    fields = [fmt for fmt in variable_leader_format
+              if fmt[2] + struct.calcsize(fmt[1]) <= size]
+    variable_data = unpack_bytes(pd0_bytes, fields, offset,
+                                 block='variable_leader')
+    data['timestamp'] = ensemble_datetime(variable_data)
     return variable_data
 
 
@@ -173,7 +287,7 @@ def parse_per_cell_per_beam(pd0_bytes, offset,
                             data_bytes)[0]
             )
             if debug:
-                print(f'Bytes: {data_bytes}, Data: {field_data}')
+                logger.debug('Bytes: %s, Data: %s', data_bytes, field_data)
             cell_data.append(field_data)
         data.append(cell_data)
 
@@ -185,7 +299,8 @@ def parse_velocity(pd0_bytes, offset, data):
         ('id', '<H', 0),
     )
 
-    velocity_data = unpack_bytes(pd0_bytes, velocity_format, offset)
+    velocity_data = unpack_bytes(pd0_bytes, velocity_format, offset,
+                                 block='velocity')
     offset += 2  # Move past id field
     velocity_data['data'] = parse_per_cell_per_beam(
         pd0_bytes,
@@ -203,7 +318,8 @@ def parse_correlation(pd0_bytes, offset, data):
         ('id', '<H', 0),
     )
 
-    correlation_data = unpack_bytes(pd0_bytes, correlation_format, offset)
+    correlation_data = unpack_bytes(pd0_bytes, correlation_format, offset,
+                                    block='correlation')
     offset += 2
     correlation_data['data'] = parse_per_cell_per_beam(
         pd0_bytes,
@@ -222,7 +338,8 @@ def parse_echo_intensity(pd0_bytes, offset, data):
     )
 
     echo_intensity_data = unpack_bytes(pd0_bytes,
-                                       echo_intensity_format, offset)
+                                       echo_intensity_format, offset,
+                                       block='echo_intensity')
     offset += 2
     echo_intensity_data['data'] = parse_per_cell_per_beam(
         pd0_bytes,
@@ -240,7 +357,8 @@ def parse_percent_good(pd0_bytes, offset, data):
         ('id', '<H', 0),
     )
 
-    percent_good_data = unpack_bytes(pd0_bytes, percent_good_format, offset)
+    percent_good_data = unpack_bytes(pd0_bytes, percent_good_format, offset,
+                                     block='percent_good')
     offset += 2
     percent_good_data['data'] = parse_per_cell_per_beam(
         pd0_bytes,
@@ -255,10 +373,11 @@ def parse_percent_good(pd0_bytes, offset, data):
 
 def parse_status(pd0_bytes, offset, data):
     status_format = (
-        ('id', '<H', 0)
+        ('id', '<H', 0),
     )
 
-    status_data = unpack_bytes(pd0_bytes, status_format, offset)
+    status_data = unpack_bytes(pd0_bytes, status_format, offset,
+                               block='status')
     offset += 2
     status_data['data'] = parse_per_cell_per_beam(
         pd0_bytes,
@@ -283,9 +402,8 @@ def parse_bottom_track(pd0_bytes, offset, data):
         ('error_velocity_maximum', '<H', 10)
     )
 
-    bottom_track_data, data_size = unpack_bytes(pd0_bytes,
-                                                bottom_track_format, offset)
-    offset += data_size
+    bottom_track_data = unpack_bytes(pd0_bytes, bottom_track_format, offset,
+                                     block='bottom_track')
     # Plan to implement as needed
     raise NotImplementedError()
 
@@ -328,6 +446,9 @@ def parse_pd0_bytearray(pd0_bytes):
     to determine what funcitons to run given a specified offset and header
     ID at that offset.
 
+    Blocks without a parser are skipped and counted in the module
+    diagnostics collector instead of being printed.
+
     Returns a dictionary of values parsed out into Python types.
     """
 
@@ -344,15 +465,27 @@ def parse_pd0_bytearray(pd0_bytes):
                               data['header']['number_of_data_types'])
     )
 
-    for offset in data['header']['address_offsets']:
-        header_id = struct.unpack('<H', memoryview(pd0_bytes)[offset:offset + 2])[0]
+    address_offsets = data['header']['address_offsets']
+    block_ends = address_offsets[1:] + [data['header']['number_of_bytes']]
+    view = memoryview(pd0_bytes)
+    for offset, block_end in zip(address_offsets, block_ends):
+        header_id = struct.unpack_from('<H', view, offset)[0]
         if header_id in output_data_parsers:
             key = output_data_parsers[header_id][0]
             parser = output_data_parsers[header_id][1]
-            data[key] = (
-                parser(pd0_bytes, offset, data)
-            )
+            try:
+                # Parsers only see bytes up to the end of their block
+                data[key] = (
+                    parser(view[:block_end], offset, data)
+                )
+            except NotImplementedError:
+                diagnostics.unknown_block(header_id, block_end - offset)
+            except struct.error:
+                diagnostics.field_error(key, 'data', 'block', offset,
+                                        block_end - offset)
         else:
-            print(f'No parser found for header {header_id}')
+            # Unknown blocks are skipped by size using the next address
+            # offset rather than reported on every ensemble
+            diagnostics.unknown_block(header_id, block_end - offset)
 
     return data
@@ -0,0 +1,170 @@
+import logging
+import struct
+
+from trdi_adcp_readers.pd0.pd0_parser import (
+    clock_fields,
+    ensemble_datetime,
+    unpack_bytes,
+    variable_leader_format
+)
+
+logger = logging.getLogger(__name__)
+
+
+ENSEMBLE_ID = b'\x7f\x7f'
+
+# Header ID, data source, number of bytes, spare and data type count
+MINIMUM_ENSEMBLE_SIZE = 8
+
+VARIABLE_LEADER_ID = 0x0080
+
+_clock_format = [fmt for fmt in variable_leader_format
+                 if fmt[0] in clock_fields]
+
+
+def next_ensemble(pd0_bytes, start=0):
+    """
+    Searches pd0_bytes from start for the next ensemble with a valid
+    checksum.
+
+    Returns a tuple of (offset, size) where size includes the trailing
+    checksum.  size is None when an ensemble header was found at offset
+    but the buffer ends before the ensemble does.  offset is None when no
+    header was found.
+    """
+    view = memoryview(pd0_bytes)
+    length = len(pd0_bytes)
+    offset = pd0_bytes.find(ENSEMBLE_ID, start)
+    while offset >= 0:
+        if offset + 4 > length:
+            return offset, None
+
+        number_of_bytes = struct.unpack_from('<H', view, offset + 2)[0]
+        size = number_of_bytes + 2
+        if number_of_bytes >= MINIMUM_ENSEMBLE_SIZE:
+            if offset + size > length:
+                return offset, None
+
+            calc_checksum = sum(view[offset:offset + number_of_bytes]) & 0xFFFF
+            given_checksum = struct.unpack_from(
+                '<H', view, offset + number_of_bytes
+            )[0]
+            if calc_checksum == given_checksum:
+                return offset, size
+
+        logger.debug('Skipping invalid ensemble header at %d', offset)
+        offset = pd0_bytes.find(ENSEMBLE_ID, offset + 1)
+
+    return None, None
+
+
+def scan_ensemble_offsets(pd0_bytes):
+    """
+    Returns a list of (offset, size) tuples for every valid ensemble in
+    an in memory PD0 buffer.  Bytes between ensembles are skipped.
+    """
+    ensembles = []
+    start = 0
+    while True:
+        offset, size = next_ensemble(pd0_bytes, start)
+        if offset is None:
+            break
+        elif size is None:
+            # Truncated or corrupt header, keep looking past it
+            start = offset + 1
+        else:
+            ensembles.append((offset, size))
+            start = offset + size
+
+    return ensembles
+
+
+def iter_ensemble_bytes(stream, chunk_size=65536):
+    """
+    Reads a binary stream of concatenated PD0 ensembles and yields each
+    ensemble with a valid checksum as a bytearray.
+
+    Only the current chunk and at most one partial ensemble are held in
+    memory, so arbitrarily large files can be processed.
+    """
+    buffer = bytearray()
+    start = 0
+    eof = False
+    while True:
+        offset, size = next_ensemble(buffer, start)
+        if size is not None:
+            start = offset + size
+            yield buffer[offset:start]
+            continue
+
+        if offset is None:
+            # Keep a trailing byte that may start the next header
+            start = max(start, len(buffer) - 1)
+        elif eof:
+            # A truncated or corrupt header at the end of the stream
+            start = offset + 1
+            continue
+        else:
+            start = offset
+
+        if eof:
+            return
+
+        # Drop consumed bytes once per chunk rather than per ensemble
+        del buffer[:start]
+        start = 0
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        else:
+            buffer += chunk
+
+
+def block_offsets(pd0_bytes):
+    """
+    Returns the address offsets of the data blocks of a raw ensemble
+    """
+    view = memoryview(pd0_bytes)
+    number_of_data_types = view[5]
+    return list(struct.unpack_from('<%dH' % number_of_data_types, view, 6))
+
+
+def find_block(pd0_bytes, offsets, header_id):
+    """
+    Returns the (offset, end) of the block of a raw ensemble with the
+    given header ID.  The block ends where the next one starts or, for
+    the last block, at the checksum.
+    """
+    view = memoryview(pd0_bytes)
+    number_of_bytes = struct.unpack_from('<H', view, 2)[0]
+    for offset in offsets:
+        if struct.unpack_from('<H', view, offset)[0] == header_id:
+            end = min([later for later in offsets if later > offset] +
+                      [number_of_bytes])
+            return offset, end
+    raise ValueError('Ensemble has no block 0x%04X' % header_id)
+
+
+def raw_ensemble_counter(pd0_bytes):
+    """
+    Decodes only the ensemble number (extended by the roll over byte) of
+    a raw ensemble without parsing it.
+    """
+    view = memoryview(pd0_bytes)
+    offset, end = find_block(view, block_offsets(view), VARIABLE_LEADER_ID)
+    number = struct.unpack_from('<H', view, offset + 2)[0]
+    return (view[offset + 11] << 16) | number
+
+
+def raw_ensemble_time(pd0_bytes):
+    """
+    Decodes only the real time clock of a raw ensemble without parsing
+    it.  Returns a datetime, see pd0_parser.ensemble_clock.
+    """
+    view = memoryview(pd0_bytes)
+    offset, end = find_block(view, block_offsets(view), VARIABLE_LEADER_ID)
+    # Older firmware ends the variable leader before the Y2K clock
+    fields = [fmt for fmt in _clock_format
+              if offset + fmt[2] + struct.calcsize(fmt[1]) <= end]
+    return ensemble_datetime(unpack_bytes(view, fields, offset,
+                                          block='variable_leader'))
@@ -1,19 +1,29 @@
 #!/usr/bin/env python3
 
+import base64
 
-# Taken from http://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks-in-python
-def chunks(l, n):
-    """ Yield successive n-sized chunks from l.
-    """
-    for i in range(0, len(l), n):
-        yield l[i:i+n]
+from trdi_adcp_readers.compression import open_binary
+
+
+# PD15 stores each 6 bit group as a character offset from 0x40.  The
+# groups are packed in the same order as base64, so the base64 codec
+# can do the bit shuffling and a translation table swaps alphabets.
+BASE64_ALPHABET = (b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+                   b'0123456789+/')
+PD15_ALPHABET = bytes(range(0x40, 0x80))
+base64_to_pd15 = bytes.maketrans(BASE64_ALPHABET, PD15_ALPHABET)
+# Only the low 6 bits of a PD15 character are significant
+pd15_to_base64 = bytes(BASE64_ALPHABET[c & 0x3f] for c in range(256))
 
 
 def PD15_file_to_PD0(path, header_lines=0):
     """
     Parses a PD15 formatted file and returns a list of PD0 Strings
+
+    path may also be a binary file object.  gzip, bzip2 and xz
+    compressed input is decompressed on the fly.
     """
-    with open(path, 'rb') as f:
+    with open_binary(path) as f:
         if (header_lines > 0):
             for i in range(0, header_lines):
                 f.readline()
@@ -29,36 +39,34 @@ def PD15_string_to_PD0(line):
     Parses a single PD15 line and returns a PD0 byte array
     """
     if isinstance(line, str):
-        line_bytes = bytearray(line.encode('ASCII'))
-    elif isinstance(line, bytes):
-        line_bytes = bytearray(line)
-    else:
-        line_bytes = line
-        
-    line_chunks = chunks(line_bytes, 4)
-
-    pd0_out = bytearray(len(line_bytes))
-    pd0_index = 0
-    for c in line_chunks:
-        if (len(c) >= 2):
-            temp_int = (c[0] & 0x3f) << 2
-            temp_int |= (c[1] & 0x30) >> 4
-            pd0_out[pd0_index] = temp_int
-            pd0_index += 1
-
-            if (len(c) >= 3):
-                temp_int = (c[1] & 0x0f) << 4
-                temp_int |= (c[2] & 0x3c) >> 2
-                pd0_out[pd0_index] = temp_int
-                pd0_index += 1
-
-                if (len(c) == 4):
-                    temp_int = (c[2] & 0x03) << 6
-                    temp_int |= (c[3] & 0x3f)
-                    pd0_out[pd0_index] = temp_int
-                    pd0_index += 1
-
-    return pd0_out[:pd0_index+1]
+        line = line.encode('ASCII')
+
+    line_bytes = bytes(line).translate(pd15_to_base64)
+    # A trailing group of 2 or 3 characters still holds 1 or 2 bytes,
+    # a lone character holds none
+    remainder = len(line_bytes) % 4
+    if remainder == 1:
+        line_bytes = line_bytes[:-1]
+    elif remainder:
+        line_bytes += b'=' * (4 - remainder)
+
+    pd0_out = bytearray(base64.b64decode(line_bytes))
+    if line:
+        # Keep the trailing zero byte earlier versions returned
+        pd0_out.append(0)
+    return pd0_out
+
+
+def PD0_to_PD15_string(pd0_bytes):
+    """
+    Packs PD0 bytes into a PD15 6-bit ASCII byte string.  This is the
+    inverse of PD15_string_to_PD0.  Like the instrument, the PD0 data is
+    zero padded to a whole number of 3 byte groups.
+    """
+    padding = -len(pd0_bytes) % 3
+    return base64.b64encode(
+        bytes(pd0_bytes) + b'\x00' * padding
+    ).translate(base64_to_pd15)
 
 import sys
 import argparse
@@ -0,0 +1,97 @@
+import queue
+import threading
+
+from trdi_adcp_readers.compression import open_binary
+from trdi_adcp_readers.pd0.pd0_parser import parse_pd0_bytearray
+from trdi_adcp_readers.pd0.pd0_stream import iter_ensemble_bytes
+
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_MEMORY_BUDGET = 16 << 20
+
+
+class ReadAheadStream(object):
+    """
+    Reads a binary stream on a background thread.
+
+    Chunks of chunk_size bytes are handed to the consumer through a
+    bounded queue holding at most memory_budget bytes, so the reader
+    blocks (backpressure) once the consumer falls behind.  read()
+    returns whole chunks in stream order and b'' at the end of the
+    stream.  Exceptions raised while reading are re-raised by read().
+    """
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE,
+                 memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(max(1, memory_budget // chunk_size))
+        self.stopped = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self._read_chunks, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_chunks(self):
+        try:
+            while not self.stopped.is_set():
+                chunk = self.stream.read(self.chunk_size)
+                if not self._put(chunk) or not chunk:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def read(self, size=-1):
+        """
+        Returns the next chunk read by the background thread.  size is
+        accepted for file compatibility but chunks are never split.
+        """
+        if self.finished:
+            return b''
+
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            self.finished = True
+            raise item
+        if not item:
+            self.finished = True
+        return item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_PD0_file_pipelined(path, header_lines=0, return_pd0=False,
+                            chunk_size=DEFAULT_CHUNK_SIZE,
+                            memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Parses every ensemble in a PD0 file like iter_PD0_file while a
+    background thread reads ahead, overlapping I/O latency (e.g. on
+    network mounts or decompression) with parsing.  Ensembles are
+    yielded in file order.
+    """
+    with open_binary(path) as f:
+        for i in range(0, header_lines):
+            f.readline()
+
+        with ReadAheadStream(f, chunk_size, memory_budget) as stream:
+            for pd0_bytes in iter_ensemble_bytes(stream, chunk_size):
+                data = parse_pd0_bytearray(pd0_bytes)
+                if return_pd0:
+                    yield data, pd0_bytes
+                else:
+                    yield data
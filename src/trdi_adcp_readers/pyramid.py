@@ -0,0 +1,389 @@
+import os
+import shutil
+import tempfile
+from array import array
+from itertools import islice
+
+from trdi_adcp_readers.cache import map_packed_file, write_packed_header
+from trdi_adcp_readers.columnar import (
+    BAD_VELOCITY,
+    array_layout,
+    padding,
+    pd0_to_columns,
+    unpack_arrays
+)
+from trdi_adcp_readers.compression import open_binary
+from trdi_adcp_readers.pd0.pd0_stream import iter_ensemble_bytes
+from trdi_adcp_readers.timestamps import (
+    decode_timestamps,
+    select_time_range
+)
+
+
+PYRAMID_MAGIC = b'TRDP'
+PYRAMID_VERSION = 2
+PYRAMID_SUFFIX = '.pyramid'
+
+# Full resolution data is read from the PD0 file or a ColumnCache, so
+# the finest level already averages several ensembles
+DEFAULT_FACTORS = (10, 100, 1000)
+DEFAULT_KEYS = ('velocity', 'echo_intensity')
+
+# Ensembles decoded together with pd0_to_columns while building
+BATCH_SIZE = 1024
+
+statistics = ('mean', 'minimum', 'maximum')
+
+
+def pyramid_path(path):
+    """
+    Returns the path of the pyramid stored beside a PD0 file
+    """
+    return path + PYRAMID_SUFFIX
+
+
+def _level_arrays(keys):
+    """
+    Yields the (name, typecode) of every array stored for a level
+    """
+    for name in ('start', 'end', 'ensembles'):
+        yield name, 'q'
+    for key in keys:
+        for name in statistics:
+            yield '%s/%s' % (key, name), 'd'
+
+
+class _LevelBuilder(object):
+    """
+    Accumulates bins of the next finer level (or single ensembles) until
+    width of them have been added, then emits one bin.  Emitted bins are
+    appended to a temporary file per array rather than kept in memory.
+    """
+    def __init__(self, factor, width, size, keys):
+        self.factor = factor
+        self.width = width
+        self.size = size
+        self.keys = keys
+        self.files = dict((name, tempfile.TemporaryFile())
+                          for name, typecode in _level_arrays(keys))
+        self.number_of_bins = 0
+        self.pending = 0
+        self.partial = None
+
+    def add(self, part):
+        """
+        Adds a bin and returns the completed bin of this level, if any
+        """
+        if self.partial is None:
+            self.partial = {
+                'start': part['start'],
+                'ensembles': 0,
+                'values': dict(
+                    (key, [list(values) for values in part['values'][key]])
+                    for key in self.keys
+                )
+            }
+        else:
+            for key in self.keys:
+                sums, counts, minima, maxima = self.partial['values'][key]
+                new_sums, new_counts, new_minima, new_maxima = (
+                    part['values'][key]
+                )
+                for i in range(0, self.size):
+                    sums[i] += new_sums[i]
+                    counts[i] += new_counts[i]
+                    if new_minima[i] < minima[i]:
+                        minima[i] = new_minima[i]
+                    if new_maxima[i] > maxima[i]:
+                        maxima[i] = new_maxima[i]
+        self.partial['end'] = part['end']
+        self.partial['ensembles'] += part['ensembles']
+        self.pending += 1
+        if self.pending == self.width:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """
+        Emits the current bin, even if it is not full
+        """
+        part = self.partial
+        if part is None:
+            return None
+
+        nan = float('nan')
+        for name in ('start', 'end', 'ensembles'):
+            array('q', [part[name]]).tofile(self.files[name])
+        for key in self.keys:
+            sums, counts, minima, maxima = part['values'][key]
+            array('d', [
+                total / count if count else nan
+                for total, count in zip(sums, counts)
+            ]).tofile(self.files[key + '/mean'])
+            array('d', [
+                value if count else nan
+                for value, count in zip(minima, counts)
+            ]).tofile(self.files[key + '/minimum'])
+            array('d', [
+                value if count else nan
+                for value, count in zip(maxima, counts)
+            ]).tofile(self.files[key + '/maximum'])
+        self.number_of_bins += 1
+        self.partial = None
+        self.pending = 0
+        return part
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def _ensemble_part(columns, ensemble, timestamp, keys, size):
+    """
+    Returns the single ensemble bin fed to the finest level
+    """
+    inf = float('inf')
+    values = {}
+    start = ensemble * size
+    for key in keys:
+        profile = columns[key][start:start + size]
+        if key == 'velocity':
+            counts = [0 if value == BAD_VELOCITY else 1 for value in profile]
+            sums = [float(value) if count else 0.0
+                    for value, count in zip(profile, counts)]
+            values[key] = (
+                sums, counts,
+                [value if count else inf
+                 for value, count in zip(sums, counts)],
+                [value if count else -inf
+                 for value, count in zip(sums, counts)]
+            )
+        else:
+            sums = [float(value) for value in profile]
+            values[key] = (sums, [1] * size, sums, sums)
+
+    return {'start': timestamp, 'end': timestamp, 'ensembles': 1,
+            'values': values}
+
+
+def _write_pyramid(path, header, builders):
+    """
+    Writes the header and the arrays spooled by the level builders to
+    path, replacing it only once the pyramid is complete
+    """
+    arrays = []
+    for index, builder in enumerate(builders):
+        for name, typecode in _level_arrays(builder.keys):
+            count = builder.number_of_bins
+            if '/' in name:
+                count *= builder.size
+            arrays.append(('%d/%s' % (index, name), typecode, count))
+    entries, size = array_layout(arrays)
+    header = dict(header, arrays=entries, size=size,
+                  levels=[[builder.factor, builder.number_of_bins]
+                          for builder in builders])
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                     suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_packed_header(f, PYRAMID_MAGIC, header)
+            for builder in builders:
+                for name, typecode in _level_arrays(builder.keys):
+                    spool = builder.files[name]
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, f)
+                    f.write(b'\x00' * padding(spool.tell()))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def build_pyramid(path, header_lines=0, factors=DEFAULT_FACTORS,
+                  keys=DEFAULT_KEYS, output_path=None):
+    """
+    Builds a multi-resolution summary of a PD0 deployment in one
+    streaming pass.
+
+    Level i holds one bin per factors[i] ensembles with the per cell
+    per beam mean, minimum and maximum of each profile in keys, along
+    with the first and last timestamp (epoch milliseconds) and the
+    number of ensembles in each bin.  Coarser levels are built from the
+    bins of the level below, so each factor must be a multiple of the
+    previous one.  Factors must be greater than 1; full resolution data
+    is read from the PD0 file itself (see read_PD0_columns).  Bad
+    velocities are ignored and bins without data are NaN.
+
+    Finished bins are spooled to temporary files, so memory does not
+    grow with the deployment.  The pyramid is written to output_path
+    (pyramid_path(path) by default) and returned as load_pyramid
+    returns it.
+    """
+    factors = [int(factor) for factor in factors]
+    if not factors or factors[0] < 2:
+        raise ValueError('Pyramid factors must be greater than 1')
+    for finer, coarser in zip(factors, factors[1:]):
+        if coarser % finer:
+            raise ValueError('Factor %d is not a multiple of %d' %
+                             (coarser, finer))
+
+    keys = list(keys)
+    output_path = output_path or pyramid_path(path)
+    builders = None
+    number_of_cells = number_of_beams = None
+    try:
+        with open_binary(path) as f:
+            for i in range(0, header_lines):
+                f.readline()
+
+            ensembles = iter_ensemble_bytes(f)
+            while True:
+                batch = list(islice(ensembles, BATCH_SIZE))
+                if not batch:
+                    break
+                columns = pd0_to_columns(batch)
+                if builders is None:
+                    number_of_cells = columns['number_of_cells']
+                    number_of_beams = columns['number_of_beams']
+                    size = number_of_cells * number_of_beams
+                    missing = [key for key in keys if key not in columns]
+                    if missing:
+                        raise ValueError('Ensembles have no %s data' %
+                                         ', '.join(missing))
+                    builders = []
+                    for factor, previous in zip(factors, [1] + factors):
+                        builders.append(_LevelBuilder(
+                            factor, factor // previous, size, keys
+                        ))
+                elif (columns['number_of_cells'],
+                      columns['number_of_beams']) != (number_of_cells,
+                                                      number_of_beams):
+                    raise ValueError(
+                        'Ensembles have a different cell/beam layout'
+                    )
+
+                timestamps = decode_timestamps(columns)
+                for ensemble in range(0, columns['number_of_ensembles']):
+                    part = _ensemble_part(columns, ensemble,
+                                          timestamps[ensemble], keys, size)
+                    for builder in builders:
+                        part = builder.add(part)
+                        if part is None:
+                            break
+
+        if builders is None:
+            raise ValueError('No ensembles found in %s' % path)
+
+        for i, builder in enumerate(builders):
+            part = builder.flush()
+            if part is not None:
+                for coarser in builders[i + 1:]:
+                    part = coarser.add(part)
+                    if part is None:
+                        break
+
+        _write_pyramid(output_path, {
+            'version': PYRAMID_VERSION,
+            'header_lines': header_lines,
+            'factors': factors,
+            'keys': keys,
+            'number_of_cells': number_of_cells,
+            'number_of_beams': number_of_beams
+        }, builders)
+    finally:
+        for builder in builders or []:
+            builder.close()
+
+    return load_pyramid(output_path)
+
+
+def load_pyramid(path):
+    """
+    Memory maps a pyramid written by build_pyramid.  Its arrays are
+    read-only memoryviews into the mapping.
+    """
+    header, data = map_packed_file(path, PYRAMID_MAGIC)
+    if header.get('version') != PYRAMID_VERSION:
+        raise ValueError('Unsupported pyramid version in %s' % path)
+
+    pyramid = {
+        'header_lines': header['header_lines'],
+        'factors': header['factors'],
+        'keys': header['keys'],
+        'number_of_cells': header['number_of_cells'],
+        'number_of_beams': header['number_of_beams'],
+        'levels': [
+            dict([(key, {}) for key in header['keys']], factor=factor,
+                 number_of_bins=number_of_bins)
+            for factor, number_of_bins in header['levels']
+        ]
+    }
+    for name, values in unpack_arrays(data, header['arrays']):
+        parts = name.split('/')
+        level = pyramid['levels'][int(parts[0])]
+        if len(parts) == 2:
+            level[parts[1]] = values
+        else:
+            level[parts[1]][parts[2]] = values
+
+    return pyramid
+
+
+def open_pyramid(path, header_lines=0, factors=DEFAULT_FACTORS,
+                 keys=DEFAULT_KEYS):
+    """
+    Loads the pyramid stored beside a PD0 file.  It is built first when
+    it is missing, older than the file or was built with other options.
+    """
+    summary_path = pyramid_path(path)
+    if (os.path.exists(summary_path) and
+            os.path.getmtime(summary_path) >= os.path.getmtime(path)):
+        try:
+            pyramid = load_pyramid(summary_path)
+        except ValueError:
+            # Written by another version or on another platform
+            pass
+        else:
+            options = (header_lines, [int(factor) for factor in factors],
+                       list(keys))
+            if (pyramid['header_lines'], pyramid['factors'],
+                    pyramid['keys']) == options:
+                return pyramid
+
+    return build_pyramid(path, header_lines, factors, keys, summary_path)
+
+
+def query_pyramid(pyramid, start=None, end=None, pixels=1000):
+    """
+    Returns the coarsest level that still has at least pixels bins
+    starting within [start, end) (epoch milliseconds or datetimes,
+    either may be None).  Returns None when even the finest level has
+    fewer bins; read the full resolution columns for the range instead.
+
+    The result holds the level factor, the 'start', 'end' and
+    'ensembles' arrays of the selected bins and, for each key, their
+    'mean', 'minimum' and 'maximum' arrays in (bin, cell, beam) order.
+    """
+    size = pyramid['number_of_cells'] * pyramid['number_of_beams']
+    for level in sorted(pyramid['levels'], key=lambda l: -l['factor']):
+        bins = select_time_range(level['start'], start, end)
+        if bins.stop - bins.start >= pixels:
+            break
+    else:
+        return None
+
+    result = {
+        'factor': level['factor'],
+        'number_of_bins': bins.stop - bins.start
+    }
+    for name in ('start', 'end', 'ensembles'):
+        result[name] = level[name][bins]
+    values = slice(bins.start * size, bins.stop * size)
+    for key in pyramid['keys']:
+        result[key] = dict(
+            (name, level[key][name][values]) for name in statistics
+        )
+
+    return result
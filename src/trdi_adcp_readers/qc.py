@@ -0,0 +1,306 @@
+import math
+from array import array
+
+from trdi_adcp_readers.columnar import BAD_VELOCITY, configuration_column
+
+
+coordinate_systems = {
+    0: 'beam',
+    1: 'instrument',
+    2: 'ship',
+    3: 'earth'
+}
+
+
+def coordinate_system(fixed_leader):
+    """
+    Returns the coordinate system name encoded in bits 3-4 of the
+    fixed leader coordinate transformation byte.
+    """
+    return coordinate_systems[
+        (fixed_leader['coordinate_transformation_process'] >> 3) & 0x03
+    ]
+
+
+def _threshold_mask(values, minimum):
+    """
+    Builds a 0/1 mask of unsigned byte values >= minimum using a
+    translation table so the comparison runs over the whole column at
+    once.
+    """
+    table = bytes(1 if v >= minimum else 0 for v in range(256))
+    return values.tobytes().translate(table)
+
+
+def _and_masks(masks, size):
+    """
+    Combines 0/1 byte masks of the same length with a logical AND.
+    """
+    combined = (1 << (8 * size)) - 1
+    for mask in masks:
+        combined &= int.from_bytes(mask, 'little')
+    return combined.to_bytes(size, 'little')
+
+
+def _expand_cells(cell_mask, number_of_beams):
+    """
+    Repeats each (ensemble, cell) mask value for every beam.
+    """
+    beams = range(number_of_beams)
+    return bytes(value for value in cell_mask for _ in beams)
+
+
+def side_lobe_good_cells(fixed_leader, boundary_distance):
+    """
+    Returns the number of cells that lie within the side-lobe free
+    range when the boundary (surface or bottom) is boundary_distance
+    meters from the transducer.
+
+    Cells are rejected once their center is farther than
+    boundary_distance * cos(beam_angle) minus one cell length.
+    """
+    cell_length = fixed_leader['depth_cell_length']
+    cutoff = (boundary_distance * 100.0 *
+              math.cos(math.radians(fixed_leader['beam_angle'])) -
+              cell_length)
+    if cutoff < fixed_leader['bin_1_distance']:
+        return 0
+
+    good_cells = int((cutoff - fixed_leader['bin_1_distance']) //
+                     cell_length) + 1
+    return min(good_cells, fixed_leader['number_of_cells'])
+
+
+def build_qc_masks(columns, correlation_minimum=None,
+                   percent_good_minimum=None, error_velocity_maximum=None,
+                   side_lobe=False, boundary_distance=None):
+    """
+    Builds QC masks over whole (ensemble, cell, beam) columns as returned
+    by ensembles_to_columns.
+
+    Thresholds default to the values configured in the fixed leader
+    (low_correlation_threshold, minimum_percentage_water_profile_pings
+    and error_velocity_threshold).  A threshold of 0 disables that test.
+    In earth coordinates percent good is tested as the sum of three and
+    four beam solutions and error velocity is taken from beam 4.
+
+    Side-lobe rejection is opt in.  boundary_distance gives the distance
+    in meters from the transducer to the surface or bottom for every
+    ensemble and defaults to depth_of_transducer.  The cutoff uses the
+    bin layout of each ensemble from its configuration columns.
+
+    Returns a dictionary of 0/1 byte masks (1 is good) keyed by test
+    name plus a combined 'good' mask.
+    """
+    fixed_leader = columns['fixed_leader']
+    number_of_ensembles = columns['number_of_ensembles']
+    number_of_cells = columns['number_of_cells']
+    number_of_beams = columns['number_of_beams']
+    size = number_of_ensembles * number_of_cells * number_of_beams
+    earth = coordinate_system(fixed_leader) == 'earth'
+
+    if correlation_minimum is None:
+        correlation_minimum = fixed_leader['low_correlation_threshold']
+    if percent_good_minimum is None:
+        percent_good_minimum = (
+            fixed_leader['minimum_percentage_water_profile_pings']
+        )
+    if error_velocity_maximum is None:
+        error_velocity_maximum = fixed_leader['error_velocity_threshold']
+
+    masks = {}
+    if 'velocity' in columns:
+        masks['bad_velocity'] = bytes(
+            value != BAD_VELOCITY for value in columns['velocity']
+        )
+
+    if correlation_minimum and 'correlation' in columns:
+        masks['low_correlation'] = _threshold_mask(columns['correlation'],
+                                                   correlation_minimum)
+
+    if percent_good_minimum and 'percent_good' in columns:
+        percent_good = columns['percent_good']
+        if earth and number_of_beams == 4:
+            cell_mask = bytes(
+                three + four >= percent_good_minimum
+                for three, four in zip(percent_good[0::4],
+                                       percent_good[3::4])
+            )
+            masks['low_percent_good'] = _expand_cells(cell_mask,
+                                                      number_of_beams)
+        else:
+            masks['low_percent_good'] = _threshold_mask(
+                percent_good, percent_good_minimum
+            )
+
+    if (error_velocity_maximum and earth and number_of_beams == 4 and
+            'velocity' in columns):
+        cell_mask = bytes(
+            -error_velocity_maximum <= value <= error_velocity_maximum or
+            value == BAD_VELOCITY
+            for value in columns['velocity'][3::4]
+        )
+        masks['high_error_velocity'] = _expand_cells(cell_mask,
+                                                     number_of_beams)
+
+    if side_lobe:
+        if boundary_distance is None:
+            boundary_distance = [
+                depth / 10.0 for depth in
+                columns['variable_leader']['depth_of_transducer']
+            ]
+        if len(boundary_distance) != number_of_ensembles:
+            raise ValueError(
+                'Expected %d boundary distances, got %d' % (
+                    number_of_ensembles, len(boundary_distance)
+                )
+            )
+        # Each ensemble uses its own bin layout, which changes when the
+        # instrument is reconfigured during a deployment
+        layouts = {}
+        good_cells = []
+        for distance, bin_1_distance, depth_cell_length in zip(
+                boundary_distance,
+                configuration_column(columns, 'bin_1_distance'),
+                configuration_column(columns, 'depth_cell_length')):
+            layout = layouts.get((bin_1_distance, depth_cell_length))
+            if layout is None:
+                layout = layouts[bin_1_distance, depth_cell_length] = dict(
+                    fixed_leader, bin_1_distance=bin_1_distance,
+                    depth_cell_length=depth_cell_length
+                )
+            good_cells.append(side_lobe_good_cells(layout, distance))
+        cell_mask = b''.join(
+            b'\x01' * good + b'\x00' * (number_of_cells - good)
+            for good in good_cells
+        )
+        masks['side_lobe'] = _expand_cells(cell_mask, number_of_beams)
+
+    masks['good'] = _and_masks(masks.values(), size)
+    return masks
+
+
+def apply_mask(values, mask, fill_value=BAD_VELOCITY):
+    """
+    Returns a copy of a column with every masked out element replaced
+    by fill_value.
+    """
+    typecode = getattr(values, 'typecode', None) or values.format
+    return array(typecode,
+                 [value if good else fill_value
+                  for value, good in zip(values, mask)])
+
+
+def qc_summaries(columns, masks):
+    """
+    Returns a list with one dictionary per ensemble counting the total
+    number of values, the number of good values and the number of
+    values rejected by each test.
+    """
+    ensemble_size = columns['number_of_cells'] * columns['number_of_beams']
+    ensemble_numbers = columns['variable_leader'].get('ensemble_number')
+    summaries = []
+    for ensemble in range(0, columns['number_of_ensembles']):
+        start = ensemble * ensemble_size
+        end = start + ensemble_size
+        summary = {
+            'total': ensemble_size,
+            'good': masks['good'].count(1, start, end)
+        }
+        if ensemble_numbers is not None:
+            summary['ensemble_number'] = ensemble_numbers[ensemble]
+        for test, mask in masks.items():
+            if test != 'good':
+                summary[test] = mask.count(0, start, end)
+        summaries.append(summary)
+
+    return summaries
+
+
+def apply_qc(columns, **kwargs):
+    """
+    Runs build_qc_masks over a set of columns and returns a dictionary
+    holding the masks, masked copies of each profile column and the per
+    ensemble summaries.  Velocity is filled with -32768 and the other
+    profiles with 0.
+
+    Keyword arguments are passed through to build_qc_masks.
+    """
+    masks = build_qc_masks(columns, **kwargs)
+    result = {
+        'masks': masks,
+        'summaries': qc_summaries(columns, masks)
+    }
+    for key in ('velocity', 'correlation', 'echo_intensity',
+                'percent_good'):
+        if key in columns:
+            fill_value = BAD_VELOCITY if key == 'velocity' else 0
+            result[key] = apply_mask(columns[key], masks['good'],
+                                     fill_value)
+
+    return result
+
+
+def _first_jumps(series, number_of_cells, threshold):
+    """
+    Returns, for each run of number_of_cells values in series, the index
+    of the last cell before the first increase greater than threshold.
+    """
+    jumps = bytes(
+        following - current > threshold
+        for current, following in zip(series, series[1:])
+    )
+    last_cells = []
+    for start in range(0, len(series), number_of_cells):
+        jump = jumps.find(1, start + 1, start + number_of_cells - 1)
+        last_cells.append(number_of_cells - 1 if jump < 0 else jump - start)
+
+    return last_cells
+
+
+def find_boundary_bins(echo_intensity, number_of_cells, number_of_beams,
+                       threshold=20, mode='average'):
+    """
+    Finds the last good bin before the surface or bottom echo for every
+    ensemble in a flat (ensemble, cell, beam) echo intensity sequence.
+
+    The boundary is the first cell (after the first) where echo intensity
+    jumps by more than threshold counts into the next cell.  When no jump
+    is found the last cell is returned.
+
+    mode='average' averages echo intensity across beams and returns one
+    0-based bin per ensemble.  mode='beam' tests each beam separately and
+    returns number_of_beams bins per ensemble in (ensemble, beam) order.
+
+    Returns an array of 0-based bin indexes.
+    """
+    if mode == 'average':
+        # Compare beam sums against a scaled threshold rather than
+        # dividing every cell
+        sums = [sum(cell) for cell in zip(
+            *(echo_intensity[beam::number_of_beams]
+              for beam in range(number_of_beams))
+        )]
+        return array('h', _first_jumps(sums, number_of_cells,
+                                       threshold * number_of_beams))
+    elif mode == 'beam':
+        per_beam = [
+            _first_jumps(echo_intensity[beam::number_of_beams],
+                         number_of_cells, threshold)
+            for beam in range(number_of_beams)
+        ]
+        return array('h', [last for ensemble in zip(*per_beam)
+                           for last in ensemble])
+    else:
+        raise ValueError('Unknown boundary detection mode %s' % mode)
+
+
+def find_last_good_bins(columns, threshold=20, mode='average'):
+    """
+    Runs find_boundary_bins over the echo intensity of a set of columns
+    as returned by ensembles_to_columns.
+    """
+    return find_boundary_bins(columns['echo_intensity'],
+                              columns['number_of_cells'],
+                              columns['number_of_beams'],
+                              threshold, mode)
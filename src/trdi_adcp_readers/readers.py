@@ -1,8 +1,11 @@
+from trdi_adcp_readers.columnar import pd0_to_columns
+from trdi_adcp_readers.compression import open_binary
 from trdi_adcp_readers.pd15.pd0_converters import (
     PD15_file_to_PD0,
     PD15_string_to_PD0
 )
 from trdi_adcp_readers.pd0.pd0_parser import parse_pd0_bytearray
+from trdi_adcp_readers.pd0.pd0_stream import iter_ensemble_bytes
 
 
 def read_PD15_file(path, header_lines=0, return_pd0=False):
@@ -37,7 +40,7 @@ def read_PD15_string(string, return_pd0=False):
 
 def read_PD0_file(path, header_lines=0, return_pd0=False):
     pd0_bytes = bytearray()
-    with open(path, 'rb') as f:
+    with open_binary(path) as f:
         for i in range(0, header_lines):
             f.readline()
 
@@ -50,6 +53,51 @@ def read_PD0_file(path, header_lines=0, return_pd0=False):
         return data
 
 
+def iter_PD0_file(path, header_lines=0, return_pd0=False):
+    """
+    Lazily parses every ensemble in a multi-ensemble PD0 file.  The file
+    is read in chunks so memory does not grow with the file size.
+
+    path may also be a binary file object.  gzip, bzip2 and xz
+    compressed input is decompressed on the fly.
+    """
+    with open_binary(path) as f:
+        for i in range(0, header_lines):
+            f.readline()
+
+        for pd0_bytes in iter_ensemble_bytes(f):
+            data = parse_pd0_bytearray(pd0_bytes)
+            if return_pd0:
+                yield data, pd0_bytes
+            else:
+                yield data
+
+
+def read_PD0_columns(path, header_lines=0, cache=None):
+    """
+    Decodes every ensemble in a PD0 file into columns (see
+    columnar.pd0_to_columns).
+
+    When cache is a cache.ColumnCache, previously decoded files are
+    memory mapped from the cache instead of being parsed again.
+    """
+    if cache is not None:
+        key = cache.key(path, variant=header_lines)
+        columns = cache.load(key)
+        if columns is not None:
+            return columns
+
+    with open_binary(path) as f:
+        for i in range(0, header_lines):
+            f.readline()
+
+        columns = pd0_to_columns(iter_ensemble_bytes(f))
+
+    if cache is not None:
+        cache.store(key, columns)
+    return columns
+
+
 def read_PD0_bytes(pd0_bytes, return_pd0=False):
     data = parse_pd0_bytearray(pd0_bytes)
     if return_pd0:
@@ -0,0 +1,181 @@
+import math
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+
+from trdi_adcp_readers.columnar import BAD_VELOCITY, configuration_column
+
+
+@lru_cache(maxsize=256)
+def bin_ranges(number_of_cells, bin_1_distance, depth_cell_length):
+    """
+    Returns the distance in meters of each bin center from the
+    transducer along the instrument axis.
+
+    bin_1_distance and depth_cell_length are in centimeters, as stored
+    in the fixed leader.  Results are cached, so ensembles sharing a
+    configuration reuse the same tuple.
+    """
+    return tuple(
+        (bin_1_distance + i * depth_cell_length) / 100.0
+        for i in range(0, number_of_cells)
+    )
+
+
+def _vertical_scale(pitch=0, roll=0, upward=False):
+    """
+    Returns the factor turning distances along the instrument axis into
+    depth increments
+    """
+    scale = (math.cos(math.radians(pitch / 100.0)) *
+             math.cos(math.radians(roll / 100.0)))
+    return -scale if upward else scale
+
+
+def bin_depths(number_of_cells, bin_1_distance, depth_cell_length,
+               depth_of_transducer=0, pitch=0, roll=0, upward=False):
+    """
+    Returns the depth in meters of each bin center.
+
+    depth_of_transducer is in decimeters and pitch and roll in
+    hundredths of a degree, as stored in the variable leader.  The
+    bin_ranges are scaled by cos(pitch) * cos(roll) to get vertical
+    distances.  Bins of an upward looking instrument are above the
+    transducer.
+    """
+    scale = _vertical_scale(pitch, roll, upward)
+    transducer = depth_of_transducer / 10.0
+    return tuple(
+        transducer + scale * distance
+        for distance in bin_ranges(number_of_cells, bin_1_distance,
+                                   depth_cell_length)
+    )
+
+
+def _interpolation_weights(ranges, grid, transducer, scale):
+    """
+    Returns, for each grid depth, the indexes of the two bins around it
+    and the weight of the second, or None when the depth lies outside
+    the bins.
+
+    Grid depths are mapped onto the increasing bin ranges, so the
+    cached ranges are shared by every attitude.
+    """
+    if len(ranges) < 2 or not scale:
+        return [None] * len(grid)
+
+    last = len(ranges) - 2
+    weights = []
+    for depth in grid:
+        distance = (depth - transducer) / scale
+        if distance < ranges[0] or distance > ranges[-1]:
+            weights.append(None)
+            continue
+        k = min(bisect_right(ranges, distance) - 1, last)
+        weights.append((k, k + 1, (distance - ranges[k]) /
+                        (ranges[k + 1] - ranges[k])))
+
+    return weights
+
+
+def _ensemble_geometry(columns, upward=False, tilt_correction=True):
+    """
+    Yields the bin_ranges, transducer depth in meters and vertical
+    scale of every ensemble in a set of columns.  The bin layout of
+    each ensemble comes from its configuration columns.
+    """
+    variable_leader = columns['variable_leader']
+    number_of_ensembles = columns['number_of_ensembles']
+    zeros = [0] * number_of_ensembles
+    bin_1_distance = configuration_column(columns, 'bin_1_distance')
+    depth_cell_length = configuration_column(columns, 'depth_cell_length')
+    transducer = variable_leader.get('depth_of_transducer', zeros)
+    if tilt_correction:
+        pitch = variable_leader.get('pitch', zeros)
+        roll = variable_leader.get('roll', zeros)
+    else:
+        pitch = roll = zeros
+
+    for ensemble in range(0, number_of_ensembles):
+        yield (bin_ranges(columns['number_of_cells'],
+                          bin_1_distance[ensemble],
+                          depth_cell_length[ensemble]),
+               transducer[ensemble] / 10.0,
+               _vertical_scale(pitch[ensemble], roll[ensemble], upward))
+
+
+def ensemble_depths(columns, upward=False, tilt_correction=True):
+    """
+    Returns a list with the bin center depths (see bin_depths) of every
+    ensemble in a set of columns.
+    """
+    return [
+        tuple(transducer + scale * distance for distance in ranges)
+        for ranges, transducer, scale in _ensemble_geometry(
+            columns, upward, tilt_correction
+        )
+    ]
+
+
+def regrid_columns(columns, depth_grid,
+                   keys=('velocity', 'echo_intensity', 'correlation'),
+                   upward=False, tilt_correction=True):
+    """
+    Linearly interpolates profile columns onto a fixed depth grid (in
+    meters).
+
+    The bin ranges of each configuration are computed once and every
+    ensemble maps the grid onto them with its own transducer depth and
+    tilt.  Grid depths outside the bins, and any that touch a bad
+    velocity, are NaN.
+
+    Returns a dictionary with the 'depth' grid, the number of
+    ensembles, levels and beams and, for each key, a flat array('d') in
+    (ensemble, level, beam) order.
+    """
+    grid = tuple(float(depth) for depth in depth_grid)
+    number_of_ensembles = columns['number_of_ensembles']
+    number_of_beams = columns['number_of_beams']
+    ensemble_size = columns['number_of_cells'] * number_of_beams
+    beams = range(0, number_of_beams)
+    nan = float('nan')
+
+    result = {
+        'depth': array('d', grid),
+        'number_of_ensembles': number_of_ensembles,
+        'number_of_levels': len(grid),
+        'number_of_beams': number_of_beams
+    }
+    weights = [
+        _interpolation_weights(ranges, grid, transducer, scale)
+        for ranges, transducer, scale in _ensemble_geometry(
+            columns, upward, tilt_correction
+        )
+    ]
+    for key in keys:
+        if key not in columns:
+            continue
+        values = columns[key]
+        regridded = array('d')
+        for ensemble in range(0, number_of_ensembles):
+            start = ensemble * ensemble_size
+            profile = [float(value) for value in
+                       values[start:start + ensemble_size]]
+            if key == 'velocity':
+                profile = [nan if value == BAD_VELOCITY else value
+                           for value in profile]
+            for level in weights[ensemble]:
+                if level is None:
+                    regridded.extend(nan for beam in beams)
+                    continue
+                lower, upper, weight = level
+                lower *= number_of_beams
+                upper *= number_of_beams
+                regridded.extend(
+                    profile[lower + beam] +
+                    weight * (profile[upper + beam] - profile[lower + beam])
+                    for beam in beams
+                )
+        result[key] = regridded
+
+    return result
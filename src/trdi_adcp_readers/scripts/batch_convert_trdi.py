@@ -0,0 +1,355 @@
+#!/usr/bin/python
+
+from trdi_adcp_readers.pd0.pd0_parser import diagnostics
+from trdi_adcp_readers.scripts import convert_trdi, convert_trdi_uhi
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import hashlib
+import json
+import logging
+import os
+from os import path
+import sys
+import time
+
+MANIFEST_NAME = '.trdi_manifest.jsonl'
+
+output_suffixes = {
+    'pprint': ('.txt',),
+    'jsonl': ('.jsonl',),
+    'uhi': ('_info.csv', '_velocity.csv', '_data.csv')
+}
+
+
+def find_inputs(sources, file_format=None):
+    """
+    Expands files, directories (searched recursively) and glob patterns
+    into a list of unique paths.  Unless file_format is given, files
+    found in directories or by patterns must have a known extension.
+    """
+    def known(name):
+        return (file_format is not None or
+                convert_trdi.input_format(name) in convert_trdi.ext_parser_map)
+
+    inputs = []
+    for source in sources:
+        if path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                inputs.extend(path.join(root, name)
+                              for name in sorted(files) if known(name))
+        elif glob.has_magic(source):
+            inputs.extend(name for name in
+                          sorted(glob.glob(source, recursive=True))
+                          if known(name))
+        else:
+            inputs.append(source)
+
+    seen = set()
+    unique = []
+    for input_file in inputs:
+        key = path.abspath(input_file)
+        if key not in seen and path.isfile(input_file):
+            seen.add(key)
+            unique.append(input_file)
+    return unique
+
+
+def file_hash(input_file):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(input_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def output_paths(input_file, output_dir, mode):
+    """
+    Returns the output files written for an input file in a mode.  They
+    are named after the input, without any compression suffix.
+    """
+    stem = path.basename(input_file)
+    (root, ext) = path.splitext(stem)
+    if ext.lower() in ('.gz', '.bz2', '.xz'):
+        stem = root
+    return [path.join(output_dir, stem + suffix)
+            for suffix in output_suffixes[mode]]
+
+
+class Manifest(object):
+    """
+    Append-only JSON Lines record of converted inputs.
+
+    Each line holds the absolute input path, its size, modification
+    time and content hash, the conversion options and the outputs
+    written.  An input is done when the options match, the outputs still
+    exist and the size and either the modification time or the hash are
+    unchanged.  Lines are flushed as each file finishes, so an
+    interrupted run loses at most the files in flight.
+    """
+    def __init__(self, manifest_path):
+        self.path = manifest_path
+        self.entries = {}
+        if path.exists(manifest_path):
+            with open(manifest_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interrupted run
+                        continue
+                    self.entries[entry['input']] = entry
+        self.file = open(manifest_path, 'a')
+
+    def is_done(self, input_file, options):
+        entry = self.entries.get(path.abspath(input_file))
+        if entry is None or entry['options'] != options:
+            return False
+        if not all(path.exists(output) for output in entry['outputs']):
+            return False
+
+        stat = os.stat(input_file)
+        if entry['size'] != stat.st_size:
+            return False
+        if entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if entry['hash'] == file_hash(input_file):
+            # Touched but unchanged, remember the new time
+            self.record(dict(entry, mtime_ns=stat.st_mtime_ns))
+            return True
+        return False
+
+    def record(self, entry):
+        self.entries[entry['input']] = entry
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def convert_one(input_file, output_dir, options):
+    """
+    Converts one input file.  Runs in the worker processes.
+
+    Returns the manifest entry for the file.
+    """
+    stat = os.stat(input_file)
+    outputs = output_paths(input_file, output_dir, options['mode'])
+    # Each input gets its own warnings and summary, even when a worker
+    # converts several files
+    diagnostics.reset()
+    if options['mode'] == 'uhi':
+        convert_trdi_uhi.convert_file(
+            input_file, *outputs,
+            file_format=options['format'],
+            header_lines=options['headers'],
+            mag_declination=options['mag_declination']
+        )
+    else:
+        with open(outputs[0], 'w') as output:
+            convert_trdi.convert_file(input_file, output,
+                                      file_format=options['format'],
+                                      header_lines=options['headers'],
+                                      output_format=options['mode'])
+    diagnostics.log_summary(logging.WARNING, source=input_file)
+
+    return {
+        'input': path.abspath(input_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'hash': file_hash(input_file),
+        'options': options,
+        'outputs': [path.abspath(output) for output in outputs]
+    }
+
+
+def print_progress(done, total, input_file, error, elapsed, size):
+    status = 'failed: %s' % error if error else 'ok'
+    print('[%d/%d] %s %s (%.1f files/s, %.2f MB/s)' % (
+        done, total, input_file, status, done / max(elapsed, 1e-9),
+        size / 1e6 / max(elapsed, 1e-9)
+    ), file=sys.stderr)
+
+
+def run_batch(sources, output_dir, mode='pprint', workers=None,
+              manifest_path=None, file_format=None, header_lines=0,
+              mag_declination=0.0, progress=print_progress):
+    """
+    Converts every input found in sources (see find_inputs) into
+    output_dir using a pool of worker processes, skipping inputs the
+    manifest records as already converted with the same options.
+    workers=1 converts in this process.
+
+    progress is called after each file with the number done, the total,
+    the input, the error (or None), the elapsed seconds and the input
+    bytes converted so far.
+
+    Returns a dictionary with the converted, skipped and failed inputs
+    (the latter as (input, error) pairs) and the elapsed seconds.
+    """
+    if mode not in output_suffixes:
+        raise ValueError('Unknown output mode %s' % mode)
+    os.makedirs(output_dir, exist_ok=True)
+    options = {
+        'mode': mode,
+        'format': file_format,
+        'headers': header_lines,
+        'mag_declination': mag_declination
+    }
+    manifest = Manifest(manifest_path or path.join(output_dir, MANIFEST_NAME))
+    result = {'converted': [], 'skipped': [], 'failed': []}
+    start = time.time()
+    try:
+        pending = []
+        claimed = {}
+        for input_file in find_inputs(sources, file_format):
+            outputs = output_paths(input_file, output_dir, mode)
+            if outputs[0] in claimed:
+                result['failed'].append((
+                    input_file,
+                    'Output %s is already written for %s' % (
+                        outputs[0], claimed[outputs[0]]
+                    )
+                ))
+                continue
+            claimed[outputs[0]] = input_file
+            if manifest.is_done(input_file, options):
+                result['skipped'].append(input_file)
+            else:
+                pending.append(input_file)
+
+        total = len(pending)
+        done = 0
+        size = 0
+
+        def finished(input_file, entry, error):
+            nonlocal done, size
+            done += 1
+            if error is None:
+                manifest.record(entry)
+                size += entry['size']
+                result['converted'].append(input_file)
+            else:
+                result['failed'].append((input_file, error))
+            if progress is not None:
+                progress(done, total, input_file, error,
+                         time.time() - start, size)
+
+        if workers == 1:
+            for input_file in pending:
+                try:
+                    entry = convert_one(input_file, output_dir, options)
+                except Exception as e:
+                    finished(input_file, None, str(e) or repr(e))
+                else:
+                    finished(input_file, entry, None)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = dict(
+                    (executor.submit(convert_one, input_file, output_dir,
+                                     options), input_file)
+                    for input_file in pending
+                )
+                for future in as_completed(futures):
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        finished(futures[future], None, str(e) or repr(e))
+                    else:
+                        finished(futures[future], entry, None)
+    finally:
+        manifest.close()
+
+    result['seconds'] = time.time() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts many binary PD15 or PD0 TRDI ADCP files " +
+                    "in parallel, skipping files already converted",
+    )
+
+    parser.add_argument(
+        "--headers",
+        default=0,
+        help="Number of header lines to skip before looking for data",
+        type=int
+    )
+
+    parser.add_argument(
+        "--format",
+        default=None,
+        help="Binary format (pd15 or pd0) to convert from.  " +
+             "Derives from file extension if not defined."
+    )
+
+    parser.add_argument(
+        "--mode",
+        default='pprint',
+        choices=sorted(output_suffixes),
+        help="Output written for each file: the convert_trdi dump " +
+             "(pprint), convert_trdi JSON Lines (jsonl) or the " +
+             "convert_trdi_uhi CSV files (uhi)"
+    )
+
+    parser.add_argument(
+        "--mag-declination",
+        default=0.0,
+        help="Magnetic declination in degrees (uhi mode)",
+        type=float
+    )
+
+    parser.add_argument(
+        "--workers",
+        default=None,
+        help="Number of worker processes (defaults to the CPU count)",
+        type=int
+    )
+
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="Manifest of converted files (defaults to %s in the " %
+             MANIFEST_NAME + "output directory)"
+    )
+
+    parser.add_argument(
+        "output_dir",
+        help="directory to write the converted files to"
+    )
+
+    parser.add_argument(
+        "inputs",
+        nargs='+',
+        help="files, directories or glob patterns to convert"
+    )
+
+    args = parser.parse_args()
+
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    result = run_batch(
+        args.inputs,
+        args.output_dir,
+        mode=args.mode,
+        workers=args.workers,
+        manifest_path=args.manifest,
+        file_format=args.format,
+        header_lines=args.headers,
+        mag_declination=args.mag_declination
+    )
+    print('Converted %d, skipped %d, failed %d files in %.1f s' % (
+        len(result['converted']), len(result['skipped']),
+        len(result['failed']), result['seconds']
+    ), file=sys.stderr)
+    if result['failed']:
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,17 @@
 #!/usr/bin/python
 
+from trdi_adcp_readers.pd0.pd0_parser import diagnostics
 from trdi_adcp_readers.readers import (
+    iter_PD0_file,
     read_PD0_file,
     read_PD15_file
 )
 
 import argparse
+import csv
+from datetime import datetime
+import json
+import logging
 from os import path
 import sys
 
@@ -16,6 +22,127 @@ ext_parser_map = {
     'pd15': read_PD15_file
 }
 
+output_formats = ('pprint', 'jsonl', 'csv')
+
+profile_blocks = ('velocity', 'correlation', 'echo_intensity',
+                  'percent_good', 'status')
+csv_blocks = ('header', 'fixed_leader', 'variable_leader') + profile_blocks
+
+
+def input_format(input_file, file_format=None):
+    """
+    Returns the lower case binary format of an input file, derived from
+    its extension (ignoring a compression suffix) when not given
+    """
+    if file_format is not None:
+        return file_format.lower()
+
+    (root, ext) = path.splitext(input_file)
+    if ext.lower() in ('.gz', '.bz2', '.xz'):
+        (root, ext) = path.splitext(root)
+    return ext.lower()[1:]
+
+
+def iter_ensembles(input_file, file_format, header_lines=0):
+    """
+    Yields the parsed ensembles of an input file one at a time.  PD0
+    files are streamed; PD15 files hold a single ensemble.
+    """
+    if file_format == 'pd0':
+        return iter_PD0_file(input_file, header_lines)
+    return iter([ext_parser_map[file_format](input_file,
+                                             header_lines=header_lines)])
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def write_jsonl(ensembles, output):
+    """
+    Writes each ensemble as one compact JSON line as soon as it is
+    parsed
+    """
+    for ensemble in ensembles:
+        output.write(json.dumps(ensemble, separators=(',', ':'),
+                                default=_json_default))
+        output.write('\n')
+
+
+def write_csv(ensembles, output, block='velocity'):
+    """
+    Writes one block of every ensemble as CSV.  Profile blocks get one
+    row per cell with a column per beam; leader blocks get one row per
+    ensemble with a column per field.  Every row starts with the
+    ensemble number and timestamp.  Ensembles without the block are
+    skipped.
+    """
+    writer = csv.writer(output, lineterminator='\n')
+    fields = None
+    for ensemble in ensembles:
+        if block not in ensemble:
+            continue
+        data = ensemble[block]
+        prefix = [ensemble['variable_leader']['ensemble_number'],
+                  ensemble['timestamp'].isoformat()]
+        if block in profile_blocks:
+            if fields is None:
+                fields = ['ensemble_number', 'timestamp', 'cell'] + [
+                    'beam_%d' % beam
+                    for beam in range(1, len(data['data'][0]) + 1)
+                ]
+                writer.writerow(fields)
+            writer.writerows(prefix + [cell] + values
+                             for cell, values in enumerate(data['data'], 1))
+        else:
+            if fields is None:
+                fields = [field for field in data
+                          if field not in ('ensemble_number', 'timestamp')]
+                writer.writerow(['ensemble_number', 'timestamp'] + fields)
+            writer.writerow(prefix + [
+                ' '.join(map(str, data[field]))
+                if isinstance(data[field], list) else data[field]
+                for field in fields
+            ])
+
+
+def convert_file(input_file, output, file_format=None, header_lines=0,
+                 output_format='pprint', block='velocity'):
+    """
+    Parses one PD0 or PD15 file and writes it to the output text stream
+    in output_format:
+
+        pprint: the first ensemble pretty printed
+        jsonl: one JSON line per ensemble
+        csv: one block of every ensemble (see write_csv)
+
+    jsonl and csv stream the ensembles, so output starts while the file
+    is being parsed and memory does not grow with the file size.
+    """
+    file_format = input_format(input_file, file_format)
+    if file_format not in ext_parser_map:
+        raise ValueError(
+            'Unrecognized extension %s found for input file' % file_format
+        )
+
+    if output_format == 'jsonl':
+        write_jsonl(iter_ensembles(input_file, file_format, header_lines),
+                    output)
+    elif output_format == 'csv':
+        write_csv(iter_ensembles(input_file, file_format, header_lines),
+                  output, block)
+    elif output_format == 'pprint':
+        dataset = ext_parser_map[file_format](
+            input_file,
+            header_lines=header_lines
+        )
+        pp = pprint.PrettyPrinter(indent=4, stream=output)
+        pp.pprint(dataset)
+    else:
+        raise ValueError('Unknown output format %s' % output_format)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -36,6 +163,22 @@ def main():
              "Derives from file extension if not defined."
     )
 
+    parser.add_argument(
+        "--output-format",
+        default='pprint',
+        choices=output_formats,
+        help="pprint (default) prints the first ensemble, jsonl writes " +
+             "one JSON line per ensemble and csv writes one block " +
+             "(see --block) of every ensemble"
+    )
+
+    parser.add_argument(
+        "--block",
+        default='velocity',
+        choices=csv_blocks,
+        help="Block written by --output-format csv"
+    )
+
     parser.add_argument(
         "input_file",
         help="file to be converted"
@@ -43,23 +186,10 @@ def main():
 
     args = parser.parse_args()
 
-    if args.format is None:
-        (root, ext) = path.splitext(args.input_file)
-        args.format = ext.lower()[1:]
-    else:
-        args.format = args.format.lower()
-
-    if args.format in ext_parser_map:
-        dataset = ext_parser_map[args.format](
-            args.input_file,
-            header_lines=args.headers
-        )
-        pp = pprint.PrettyPrinter(indent=4)
-        pp.pprint(dataset)
-    else:
-        raise ValueError(
-            'Unrecognized extension %s found for input file' % args.format
-        )
+    convert_file(args.input_file, sys.stdout, file_format=args.format,
+                 header_lines=args.headers, output_format=args.output_format,
+                 block=args.block)
+    diagnostics.log_summary(logging.WARNING)
 
 
 if __name__ == '__main__':
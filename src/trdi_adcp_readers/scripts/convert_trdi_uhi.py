@@ -4,10 +4,13 @@ from trdi_adcp_readers.readers import (
     read_PD0_file,
     read_PD15_file
 )
+from trdi_adcp_readers.pd0.pd0_parser import diagnostics
+from trdi_adcp_readers.qc import find_boundary_bins
+from trdi_adcp_readers.scripts.convert_trdi import input_format
 
 import argparse
+import logging
 import math
-from os import path
 import sys
 
 ext_parser_map = {
@@ -73,17 +76,10 @@ def find_last_good_bin(echo_amp_data):
     Returns:
         Index of the last good bin (0-based)
     """
-    # Convert the 2D array to a 1D array by averaging across beams
-    avg_echo = [sum(bin_data)/len(bin_data) for bin_data in echo_amp_data]
-    
-    # Look for significant jumps in echo amplitude
-    for i in range(1, len(avg_echo) - 1):
-        # Check for a significant increase in echo amplitude
-        if avg_echo[i+1] - avg_echo[i] > 20:  # Threshold for significant jump
-            return i
-    
-    # If no significant jump is found, return the last bin
-    return len(echo_amp_data) - 1
+    echo_intensity = [value for bin_data in echo_amp_data
+                      for value in bin_data]
+    return find_boundary_bins(echo_intensity, len(echo_amp_data),
+                              len(echo_amp_data[0]), threshold=20)[0]
 
 
 def writeinfo(filename, time_str, bit, ssval, tiltx, tilty, bin1dist, ens_number, 
@@ -126,64 +122,18 @@ def writedat2(filename, water_depths, correlation1, correlation2, correlation3,
                     f"{percent_good3[i]:8.2f}, {percent_good4[i]:8.2f}\n")
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Converts a binary PD15 or PD0 TRDI ADCP file to UHI format CSV files",
-    )
-
-    parser.add_argument(
-        "--headers",
-        default=0,
-        help="Number of header lines to skip before looking for data",
-        type=int
-    )
-
-    parser.add_argument(
-        "--format",
-        default=None,
-        help="Binary format (pd15 or pd0) to convert from. " +
-             "Derives from file extension if not defined."
-    )
-    
-    parser.add_argument(
-        "--mag-declination",
-        default=0.0,
-        help="Magnetic declination in degrees",
-        type=float
-    )
-
-    parser.add_argument(
-        "input_file",
-        help="file to be converted"
-    )
-    
-    parser.add_argument(
-        "info_file",
-        help="output file for header information"
-    )
-    
-    parser.add_argument(
-        "velocity_file",
-        help="output file for velocity data"
-    )
-    
-    parser.add_argument(
-        "data_file",
-        help="output file for correlation and echo amplitude data"
-    )
-
-    args = parser.parse_args()
-
-    if args.format is None:
-        (root, ext) = path.splitext(args.input_file)
-        args.format = ext.lower()[1:]
-    else:
-        args.format = args.format.lower()
+def convert_file(input_file, info_file, velocity_file, data_file,
+                 file_format=None, header_lines=0, mag_declination=0.0):
+    """
+    Converts one PD0 or PD15 file to the UHI info, velocity and data
+    CSV files
+    """
+    file_format = input_format(input_file, file_format)
 
-    if args.format in ext_parser_map:
-        dataset = ext_parser_map[args.format](
-            args.input_file,
-            header_lines=args.headers
+    if file_format in ext_parser_map:
+        dataset = ext_parser_map[file_format](
+            input_file,
+            header_lines=header_lines
         )
         
         # Extract required data from the dataset
@@ -229,14 +179,13 @@ def main():
         pings = fixed_leader['pings_per_ensemble']
         transmit_lag = fixed_leader['transmit_lag_distance'] / 100.0  # Convert to meters
         transmit_pulse = fixed_leader['transmit_pulse_length'] / 100.0  # Convert to meters
-        mag_declination = args.mag_declination
         bins = fixed_leader['number_of_cells']
         
         # Find the last good bin
         last_good_counter = find_last_good_bin(echo_intensity_data) + 1  # Convert to 1-based
         
         # Write header information
-        writeinfo(args.info_file, time_str, bit, ssval, tiltx, tilty, bin1dist, ens_number,
+        writeinfo(info_file, time_str, bit, ssval, tiltx, tilty, bin1dist, ens_number,
                  temperature, heading, xducer_depth, bin_size, blank, pings,
                  transmit_lag, transmit_pulse, mag_declination, bins, last_good_counter)
         
@@ -308,19 +257,79 @@ def main():
             percent_good4.append(percent_good_data[bin_idx][3])
         
         # Write velocity data
-        writedat1(args.velocity_file, water_depths, eastward_currents, northward_currents, 
+        writedat1(velocity_file, water_depths, eastward_currents, northward_currents, 
                  upward_currents, error_velocities, current_speeds, current_directions)
         
         # Write correlation and echo amplitude data
-        writedat2(args.data_file, water_depths, correlation1, correlation2, correlation3, correlation4,
+        writedat2(data_file, water_depths, correlation1, correlation2, correlation3, correlation4,
                  echo_amp1, echo_amp2, echo_amp3, echo_amp4,
                  percent_good1, percent_good2, percent_good3, percent_good4)
         
     else:
         raise ValueError(
-            'Unrecognized extension %s found for input file' % args.format
+            'Unrecognized extension %s found for input file' % file_format
         )
 
 
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts a binary PD15 or PD0 TRDI ADCP file to UHI format CSV files",
+    )
+
+    parser.add_argument(
+        "--headers",
+        default=0,
+        help="Number of header lines to skip before looking for data",
+        type=int
+    )
+
+    parser.add_argument(
+        "--format",
+        default=None,
+        help="Binary format (pd15 or pd0) to convert from. " +
+             "Derives from file extension if not defined."
+    )
+    
+    parser.add_argument(
+        "--mag-declination",
+        default=0.0,
+        help="Magnetic declination in degrees",
+        type=float
+    )
+
+    parser.add_argument(
+        "input_file",
+        help="file to be converted"
+    )
+    
+    parser.add_argument(
+        "info_file",
+        help="output file for header information"
+    )
+    
+    parser.add_argument(
+        "velocity_file",
+        help="output file for velocity data"
+    )
+    
+    parser.add_argument(
+        "data_file",
+        help="output file for correlation and echo amplitude data"
+    )
+
+    args = parser.parse_args()
+
+    convert_file(
+        args.input_file,
+        args.info_file,
+        args.velocity_file,
+        args.data_file,
+        file_format=args.format,
+        header_lines=args.headers,
+        mag_declination=args.mag_declination
+    )
+    diagnostics.log_summary(logging.WARNING)
+
+
 if __name__ == '__main__':
     sys.exit(main())
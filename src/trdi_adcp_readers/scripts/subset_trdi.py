@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+from trdi_adcp_readers.subset import subset_PD0_file
+
+import argparse
+from datetime import datetime
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Copies a time, ensemble or cell range of a PD0 file " +
+                    "without re-encoding the data",
+    )
+
+    parser.add_argument(
+        "--headers",
+        default=0,
+        help="Number of header lines to skip before looking for data",
+        type=int
+    )
+
+    parser.add_argument(
+        "--start",
+        default=None,
+        help="First timestamp to keep (ISO 8601, e.g. 2025-05-28T12:00)",
+        type=datetime.fromisoformat
+    )
+
+    parser.add_argument(
+        "--end",
+        default=None,
+        help="Timestamp to stop before (ISO 8601)",
+        type=datetime.fromisoformat
+    )
+
+    parser.add_argument(
+        "--first-ensemble",
+        default=None,
+        help="First ensemble counter to keep: the ensemble number " +
+             "extended by the roll over byte, roll_over * 65536 + number",
+        type=int
+    )
+
+    parser.add_argument(
+        "--last-ensemble",
+        default=None,
+        help="Last ensemble counter to keep (see --first-ensemble)",
+        type=int
+    )
+
+    parser.add_argument(
+        "--cells",
+        default=None,
+        help="Keep only the first N depth cells",
+        type=int
+    )
+
+    parser.add_argument(
+        "input_file",
+        help="PD0 file to read"
+    )
+
+    parser.add_argument(
+        "output_file",
+        help="PD0 file to write"
+    )
+
+    args = parser.parse_args()
+
+    if args.cells is not None and args.cells < 1:
+        parser.error('--cells must be at least 1')
+
+    count = subset_PD0_file(
+        args.input_file,
+        args.output_file,
+        header_lines=args.headers,
+        start_time=args.start,
+        end_time=args.end,
+        first_ensemble=args.first_ensemble,
+        last_ensemble=args.last_ensemble,
+        max_cells=args.cells
+    )
+    print('Wrote %d ensembles to %s' % (count, args.output_file),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
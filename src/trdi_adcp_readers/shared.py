@@ -0,0 +1,132 @@
+import mmap
+import os
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+try:
+    import _posixshmem
+except ImportError:  # Windows or an interpreter other than CPython
+    _posixshmem = None
+
+from trdi_adcp_readers.columnar import (
+    column_groups,
+    column_layout,
+    pack_columns,
+    unpack_columns
+)
+
+
+class _AttachedBlock(object):
+    """
+    Maps an existing POSIX shared memory segment the way SharedMemory
+    does, but without registering it with the resource tracker.
+
+    Before Python 3.13 SharedMemory always registers attached segments,
+    so the tracker of a process that did not create the segment unlinks
+    it when that process exits.
+
+    This deliberately uses CPython's private _posixshmem module, which
+    SharedMemory itself is built on, rather than patching the resource
+    tracker for the whole process.  It is only used before Python 3.13
+    and when _posixshmem is available.
+    """
+    def __init__(self, name):
+        fd = _posixshmem.shm_open('/' + name, os.O_RDWR, mode=0o600)
+        try:
+            self.mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = memoryview(self.mmap)
+
+    def close(self):
+        self.buf.release()
+        self.mmap.close()
+
+    def unlink(self):
+        _posixshmem.shm_unlink('/' + self.name)
+
+
+class SharedColumns(object):
+    """
+    Decoded columns held in a multiprocessing.shared_memory block.
+
+    The producer calls SharedColumns.create(columns) and sends the small,
+    picklable descriptor to consumer processes, which call
+    SharedColumns.attach(descriptor).  Consumers see the profile and
+    variable leader arrays as memoryviews into the block, so fanning out
+    to many workers copies no data.
+
+    Every process must close() its instance when done (or use it as a
+    context manager) and the producer must unlink() the block once all
+    consumers are finished.
+    """
+    def __init__(self, block, descriptor):
+        self.block = block
+        self.descriptor = descriptor
+        self.columns = unpack_columns(block.buf, descriptor)
+
+    @classmethod
+    def create(cls, columns):
+        if shared_memory is None:
+            raise RuntimeError(
+                'Shared memory requires Python 3.8 or newer'
+            )
+
+        layout = column_layout(columns)
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(1, layout['size']))
+        pack_columns(columns, block.buf, layout)
+        descriptor = dict(layout, name=block.name)
+        return cls(block, descriptor)
+
+    @classmethod
+    def attach(cls, descriptor):
+        if shared_memory is None:
+            raise RuntimeError(
+                'Shared memory requires Python 3.8 or newer'
+            )
+
+        try:
+            block = shared_memory.SharedMemory(descriptor['name'],
+                                               track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block with the
+            # resource tracker, which would unlink it when this process
+            # exits.  Without _posixshmem fall back to SharedMemory;
+            # Windows has no resource tracker, elsewhere the tracker may
+            # unlink the block when this process exits.
+            if _posixshmem is None:
+                block = shared_memory.SharedMemory(descriptor['name'])
+            else:
+                block = _AttachedBlock(descriptor['name'])
+        return cls(block, descriptor)
+
+    def close(self):
+        """
+        Releases the column views and detaches from the block
+        """
+        for group in column_groups:
+            for values in self.columns[group].values():
+                values.release()
+        for key, values in self.columns.items():
+            if isinstance(values, memoryview):
+                values.release()
+        self.columns = None
+        self.block.close()
+
+    def unlink(self):
+        """
+        Frees the shared memory block.  Only the producer should call
+        this.
+        """
+        self.block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
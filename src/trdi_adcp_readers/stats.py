@@ -0,0 +1,225 @@
+from array import array
+
+from trdi_adcp_readers.columnar import BAD_VELOCITY
+from trdi_adcp_readers.readers import iter_PD0_file
+
+
+# Default histogram (low, high, number_of_bins) for each profile.
+# Velocity is in mm/s, the other profiles are unsigned byte counts.
+default_histogram_bins = {
+    'velocity': (-5000, 5000, 100),
+    'echo_intensity': (0, 256, 64),
+    'correlation': (0, 256, 64)
+}
+
+
+class RunningStatistics(object):
+    """
+    Running count, mean, variance, minimum, maximum and histogram of each
+    (cell, beam) element of the velocity, echo intensity and correlation
+    profiles.
+
+    Ensembles are added one at a time with update() (Welford's method)
+    or in batches of columns with update_columns().  Accumulators built
+    by parallel workers are combined with merge() (Chan et al.'s
+    pairwise update), so a deployment can be summarized without keeping
+    the data.  Bad velocities (-32768) are skipped.
+
+    All statistics are flat arrays in (cell, beam) order; histograms are
+    in (cell, beam, bin) order.  Values outside a histogram range are
+    counted in its first or last bin.
+    """
+    def __init__(self, keys=('velocity', 'echo_intensity', 'correlation'),
+                 histogram_bins=None):
+        self.keys = tuple(keys)
+        bins = dict(default_histogram_bins)
+        bins.update(histogram_bins or {})
+        self.histogram_bins = dict((key, bins[key]) for key in self.keys)
+        self.number_of_cells = None
+        self.number_of_beams = None
+        self.statistics = {}
+
+    def _initialize(self, number_of_cells, number_of_beams):
+        if self.number_of_cells is None:
+            self.number_of_cells = number_of_cells
+            self.number_of_beams = number_of_beams
+            size = number_of_cells * number_of_beams
+            for key in self.keys:
+                self.statistics[key] = {
+                    'count': array('q', [0]) * size,
+                    'mean': array('d', [0.0]) * size,
+                    'm2': array('d', [0.0]) * size,
+                    'minimum': array('d', [float('inf')]) * size,
+                    'maximum': array('d', [float('-inf')]) * size,
+                    'histogram': array('q', [0]) * (
+                        size * self.histogram_bins[key][2]
+                    )
+                }
+        elif (number_of_cells, number_of_beams) != (self.number_of_cells,
+                                                    self.number_of_beams):
+            raise ValueError(
+                'Expected %d cells and %d beams, got %d and %d' % (
+                    self.number_of_cells, self.number_of_beams,
+                    number_of_cells, number_of_beams
+                )
+            )
+
+    def _bin(self, key, value):
+        low, high, number_of_bins = self.histogram_bins[key]
+        index = int((value - low) * number_of_bins // (high - low))
+        return min(max(index, 0), number_of_bins - 1)
+
+    def update(self, ensemble):
+        """
+        Adds one parsed ensemble (as returned by parse_pd0_bytearray)
+        """
+        fixed_leader = ensemble['fixed_leader']
+        self._initialize(fixed_leader['number_of_cells'],
+                         fixed_leader['number_of_beams'])
+        for key in self.keys:
+            if key not in ensemble:
+                continue
+            statistics = self.statistics[key]
+            count = statistics['count']
+            mean = statistics['mean']
+            m2 = statistics['m2']
+            minimum = statistics['minimum']
+            maximum = statistics['maximum']
+            histogram = statistics['histogram']
+            number_of_bins = self.histogram_bins[key][2]
+            i = 0
+            for cell in ensemble[key]['data']:
+                for value in cell:
+                    if key != 'velocity' or value != BAD_VELOCITY:
+                        count[i] += 1
+                        delta = value - mean[i]
+                        mean[i] += delta / count[i]
+                        m2[i] += delta * (value - mean[i])
+                        if value < minimum[i]:
+                            minimum[i] = value
+                        if value > maximum[i]:
+                            maximum[i] = value
+                        histogram[i * number_of_bins +
+                                  self._bin(key, value)] += 1
+                    i += 1
+
+    def _combine(self, key, i, count, mean, m2, minimum, maximum):
+        statistics = self.statistics[key]
+        total = statistics['count'][i] + count
+        if total == 0:
+            return
+        delta = mean - statistics['mean'][i]
+        statistics['mean'][i] += delta * count / total
+        statistics['m2'][i] += (m2 + delta * delta *
+                                statistics['count'][i] * count / total)
+        statistics['count'][i] = total
+        statistics['minimum'][i] = min(statistics['minimum'][i], minimum)
+        statistics['maximum'][i] = max(statistics['maximum'][i], maximum)
+
+    def update_columns(self, columns):
+        """
+        Adds a batch of ensembles held as columns (as returned by
+        ensembles_to_columns or pd0_to_columns).  Each (cell, beam)
+        element is summarized over the batch and then combined with the
+        running statistics.
+        """
+        self._initialize(columns['number_of_cells'],
+                         columns['number_of_beams'])
+        size = self.number_of_cells * self.number_of_beams
+        for key in self.keys:
+            if key not in columns:
+                continue
+            values = columns[key]
+            histogram = self.statistics[key]['histogram']
+            number_of_bins = self.histogram_bins[key][2]
+            for i in range(0, size):
+                series = values[i::size]
+                if key == 'velocity':
+                    series = [value for value in series
+                              if value != BAD_VELOCITY]
+                if not len(series):
+                    continue
+                count = len(series)
+                mean = sum(series) / count
+                m2 = sum((value - mean) ** 2 for value in series)
+                self._combine(key, i, count, mean, m2, min(series),
+                              max(series))
+                start = i * number_of_bins
+                for value in series:
+                    histogram[start + self._bin(key, value)] += 1
+
+    def merge(self, other):
+        """
+        Folds the statistics of another RunningStatistics (e.g. from a
+        parallel worker) into this one.
+        """
+        if (self.keys != other.keys or
+                self.histogram_bins != other.histogram_bins):
+            raise ValueError('Accumulators track different statistics')
+        if other.number_of_cells is None:
+            return self
+        self._initialize(other.number_of_cells, other.number_of_beams)
+        for key in self.keys:
+            statistics = other.statistics[key]
+            for i in range(0, len(statistics['count'])):
+                if statistics['count'][i]:
+                    self._combine(key, i, statistics['count'][i],
+                                  statistics['mean'][i],
+                                  statistics['m2'][i],
+                                  statistics['minimum'][i],
+                                  statistics['maximum'][i])
+            histogram = self.statistics[key]['histogram']
+            for i, count in enumerate(statistics['histogram']):
+                histogram[i] += count
+
+        return self
+
+    def summary(self, ddof=0):
+        """
+        Returns a dictionary with, for each profile, the count, mean,
+        variance, minimum, maximum and histogram arrays.  Elements
+        without data have a NaN mean, variance, minimum and maximum.
+        ddof=1 gives the sample variance.
+        """
+        nan = float('nan')
+        result = {}
+        for key in self.keys:
+            statistics = self.statistics.get(key)
+            if statistics is None:
+                continue
+            counts = statistics['count']
+            result[key] = {
+                'count': array('q', counts),
+                'mean': array('d', [
+                    mean if count else nan
+                    for mean, count in zip(statistics['mean'], counts)
+                ]),
+                'variance': array('d', [
+                    m2 / (count - ddof) if count > ddof else nan
+                    for m2, count in zip(statistics['m2'], counts)
+                ]),
+                'minimum': array('d', [
+                    value if count else nan
+                    for value, count in zip(statistics['minimum'], counts)
+                ]),
+                'maximum': array('d', [
+                    value if count else nan
+                    for value, count in zip(statistics['maximum'], counts)
+                ]),
+                'histogram': array('q', statistics['histogram'])
+            }
+
+        return result
+
+
+def accumulate_PD0_file(path, header_lines=0, statistics=None):
+    """
+    Streams every ensemble of a PD0 file through a RunningStatistics
+    accumulator (a new one unless statistics is given) and returns it.
+    """
+    if statistics is None:
+        statistics = RunningStatistics()
+    for ensemble in iter_PD0_file(path, header_lines):
+        statistics.update(ensemble)
+
+    return statistics
@@ -0,0 +1,112 @@
+import struct
+
+from trdi_adcp_readers.compression import open_binary
+from trdi_adcp_readers.pd0.pd0_stream import (
+    block_offsets,
+    find_block,
+    iter_ensemble_bytes,
+    raw_ensemble_counter,
+    raw_ensemble_time
+)
+
+
+# Byte size of a single value in each per cell per beam block
+profile_value_sizes = {
+    0x0100: 2,  # velocity
+    0x0200: 1,  # correlation
+    0x0300: 1,  # echo intensity
+    0x0400: 1,  # percent good
+    0x0500: 1   # status
+}
+
+
+def truncate_cells(pd0_bytes, max_cells):
+    """
+    Returns a copy of a raw ensemble holding only the first max_cells
+    depth cells.
+
+    Only the per cell per beam blocks are shortened.  The fixed leader
+    number_of_cells byte, the address offsets, the ensemble size and the
+    checksum are rewritten; every other byte is copied unchanged.
+    """
+    view = memoryview(pd0_bytes)
+    number_of_bytes = struct.unpack_from('<H', view, 2)[0]
+    offsets = block_offsets(view)
+    fixed_offset = find_block(view, offsets, 0x0000)[0]
+    number_of_cells = view[fixed_offset + 9]
+    number_of_beams = view[fixed_offset + 8]
+    if max_cells >= number_of_cells:
+        return bytearray(pd0_bytes[:number_of_bytes + 2])
+
+    ends = offsets[1:] + [number_of_bytes]
+    header_size = offsets[0]
+    out = bytearray(view[:header_size])
+    new_offsets = []
+    for offset, end in zip(offsets, ends):
+        new_offsets.append(len(out))
+        header_id = struct.unpack_from('<H', view, offset)[0]
+        if header_id in profile_value_sizes:
+            cell_size = number_of_beams * profile_value_sizes[header_id]
+            out += view[offset:offset + 2 + max_cells * cell_size]
+            # Keep anything after the profile, such as the reserved
+            # bytes ahead of the checksum
+            out += view[offset + 2 + number_of_cells * cell_size:end]
+        else:
+            out += view[offset:end]
+
+    out[new_offsets[offsets.index(fixed_offset)] + 9] = max_cells
+    struct.pack_into('<%dH' % len(new_offsets), out, 6, *new_offsets)
+    struct.pack_into('<H', out, 2, len(out))
+    out += struct.pack('<H', sum(out) & 0xFFFF)
+    return out
+
+
+def iter_subset(ensembles, start_time=None, end_time=None,
+                first_ensemble=None, last_ensemble=None, max_cells=None):
+    """
+    Filters raw ensembles (e.g. from iter_ensemble_bytes) by time range
+    [start_time, end_time) and inclusive ensemble counter range without
+    parsing them.  first_ensemble and last_ensemble are compared with
+    raw_ensemble_counter, the 16 bit ensemble number extended by the
+    roll over byte (roll_over * 65536 + number), so they keep counting
+    up after the ensemble number wraps.  Matching ensembles are yielded
+    byte for byte unless max_cells is given, in which case they are
+    truncated with truncate_cells.
+    """
+    check_time = start_time is not None or end_time is not None
+    check_number = first_ensemble is not None or last_ensemble is not None
+    for pd0_bytes in ensembles:
+        if check_time:
+            timestamp = raw_ensemble_time(pd0_bytes)
+            if start_time is not None and timestamp < start_time:
+                continue
+            if end_time is not None and timestamp >= end_time:
+                continue
+        if check_number:
+            counter = raw_ensemble_counter(pd0_bytes)
+            if first_ensemble is not None and counter < first_ensemble:
+                continue
+            if last_ensemble is not None and counter > last_ensemble:
+                continue
+        if max_cells is not None:
+            pd0_bytes = truncate_cells(pd0_bytes, max_cells)
+        yield pd0_bytes
+
+
+def subset_PD0_file(input_path, output_path, header_lines=0, **kwargs):
+    """
+    Copies the ensembles of a PD0 file matching the iter_subset keyword
+    arguments to output_path.
+
+    Returns the number of ensembles written.
+    """
+    count = 0
+    with open_binary(input_path) as f, open(output_path, 'wb') as out:
+        for i in range(0, header_lines):
+            f.readline()
+
+        for pd0_bytes in iter_subset(iter_ensemble_bytes(f), **kwargs):
+            out.write(pd0_bytes)
+            count += 1
+
+    return count
@@ -0,0 +1,216 @@
+import hashlib
+import struct
+import time
+from array import array
+from collections import OrderedDict
+
+from trdi_adcp_readers.columnar import (
+    FIXED_LEADER_SIZE,
+    concatenate_columns,
+    pd0_to_columns
+)
+from trdi_adcp_readers.compression import open_binary
+from trdi_adcp_readers.pd0.pd0_parser import ChecksumError, validate_checksum
+from trdi_adcp_readers.pd0.pd0_stream import raw_ensemble_counter
+from trdi_adcp_readers.pd15.pd0_converters import PD15_string_to_PD0
+
+
+DEFAULT_CHUNK_SIZE = 4096
+
+DEFAULT_WINDOW = 6 * 3600
+DEFAULT_MAX_ENTRIES = 100000
+
+
+def PD15_hex_to_PD0(hex_string):
+    """
+    Converts one hex encoded PD15 message to PD0 bytes
+    """
+    if isinstance(hex_string, (bytes, bytearray)):
+        hex_string = hex_string.decode('ascii')
+    return PD15_string_to_PD0(bytes.fromhex(hex_string.strip()))
+
+
+def layout_key(pd0_bytes):
+    """
+    Validates a PD0 ensemble and returns a key identifying its layout:
+    the fixed header, address offsets and fixed leader bytes.  Ensembles
+    with the same key can be decoded together with pd0_to_columns.
+    """
+    if len(pd0_bytes) < 6:
+        raise ValueError('Message is too short to hold a PD0 header')
+    number_of_bytes = struct.unpack_from('<H', pd0_bytes, 2)[0]
+    if pd0_bytes[0] != 0x7f or len(pd0_bytes) < number_of_bytes + 2:
+        raise ValueError('Message does not hold a complete PD0 ensemble')
+    validate_checksum(pd0_bytes, number_of_bytes)
+
+    header_size = 6 + 2 * pd0_bytes[5]
+    offsets = struct.unpack_from('<%dH' % pd0_bytes[5], pd0_bytes, 6)
+    block_ids = [struct.unpack_from('<H', pd0_bytes, offset)[0]
+                 for offset in offsets]
+    if 0x0000 not in block_ids or 0x0080 not in block_ids:
+        raise ValueError('Message has no fixed or variable leader')
+    fixed_offset = offsets[block_ids.index(0x0000)]
+    return (bytes(pd0_bytes[:header_size]) +
+            bytes(pd0_bytes[fixed_offset:fixed_offset + FIXED_LEADER_SIZE]))
+
+
+def message_key(pd0_bytes, key='payload'):
+    """
+    Returns a key identifying a PD0 ensemble for duplicate detection.
+
+    key='payload' hashes the ensemble bytes (up to and including the
+    checksum), ignoring any trailing padding.  key='ensemble' uses the
+    ensemble number and checksum, which only reads four fields.
+    """
+    number_of_bytes = struct.unpack_from('<H', pd0_bytes, 2)[0]
+    if key == 'payload':
+        return hashlib.blake2b(
+            memoryview(pd0_bytes)[:number_of_bytes + 2], digest_size=16
+        ).digest()
+    elif key == 'ensemble':
+        return (raw_ensemble_counter(pd0_bytes),
+                struct.unpack_from('<H', pd0_bytes, number_of_bytes)[0])
+    else:
+        raise ValueError('Unknown message key %s' % key)
+
+
+class SeenWindow(object):
+    """
+    Bounded, time windowed set of recently seen message keys.
+
+    Keys older than window seconds are forgotten, and once more than
+    max_entries keys are held the oldest are dropped, so memory stays
+    bounded for receivers that run indefinitely.
+    """
+    def __init__(self, window=DEFAULT_WINDOW, max_entries=DEFAULT_MAX_ENTRIES,
+                 clock=time.monotonic):
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.duplicates = 0
+
+    def _expire(self, now):
+        entries = self.entries
+        while entries and now - next(iter(entries.values())) > self.window:
+            entries.popitem(last=False)
+
+    def check(self, key, now=None):
+        """
+        Records key and returns True if it was already seen within the
+        window.
+        """
+        if now is None:
+            now = self.clock()
+        self._expire(now)
+        if key in self.entries:
+            self.duplicates += 1
+            return True
+
+        self.entries[key] = now
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return False
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _decode_group(group, status):
+    """
+    Decodes the pending messages of a layout group.  When the chunk as a
+    whole fails, messages are decoded one at a time so only the broken
+    ones are flagged.
+    """
+    pending = group['pending']
+    group['pending'] = []
+    try:
+        group['parts'].append(pd0_to_columns(pd0 for _, pd0 in pending))
+        group['indexes'].extend(index for index, _ in pending)
+        return
+    except (ValueError, KeyError, struct.error):
+        pass
+
+    for index, pd0_bytes in pending:
+        try:
+            group['parts'].append(pd0_to_columns([pd0_bytes]))
+            group['indexes'].append(index)
+        except (ValueError, KeyError, struct.error) as e:
+            status[index] = 'Unable to decode message: %s' % e
+
+
+def decode_PD15_hex_messages(messages, chunk_size=DEFAULT_CHUNK_SIZE,
+                             seen=None, key='payload'):
+    """
+    Decodes many hex encoded PD15 messages (e.g. lines of a GOES
+    receiver log) into columns.
+
+    Messages are grouped by PD0 layout and each group is decoded
+    chunk_size messages at a time with pd0_to_columns.  Errors never
+    raise; they are reported per message instead.
+
+    When seen is a SeenWindow, messages whose message_key (see key) was
+    already recorded are flagged as duplicates without being decoded.
+
+    Returns a dictionary with:
+        status: one entry per message, None if it decoded or an error
+                message
+        groups: a list of dictionaries holding the 'columns' decoded for
+                one layout and the 'indexes' of the messages they came
+                from
+    """
+    status = []
+    groups = {}
+    for index, message in enumerate(messages):
+        try:
+            pd0_bytes = PD15_hex_to_PD0(message)
+            layout = layout_key(pd0_bytes)
+        except (ValueError, ChecksumError, struct.error) as e:
+            status.append('Invalid message: %s' % e)
+            continue
+
+        if seen is not None and seen.check(message_key(pd0_bytes, key)):
+            status.append('Duplicate message')
+            continue
+
+        status.append(None)
+        group = groups.get(layout)
+        if group is None:
+            group = groups[layout] = {
+                'pending': [], 'parts': [], 'indexes': array('L')
+            }
+        group['pending'].append((index, pd0_bytes))
+        if len(group['pending']) >= chunk_size:
+            _decode_group(group, status)
+
+    results = []
+    for group in groups.values():
+        if group['pending']:
+            _decode_group(group, status)
+        if len(group['parts']) == 1:
+            columns = group['parts'][0]
+        elif group['parts']:
+            columns = concatenate_columns(group['parts'])
+        else:
+            continue
+        results.append({
+            'columns': columns,
+            'indexes': group['indexes']
+        })
+
+    return {
+        'status': status,
+        'groups': results
+    }
+
+
+def read_PD15_hex_file(path, chunk_size=DEFAULT_CHUNK_SIZE, seen=None,
+                       key='payload'):
+    """
+    Decodes a file with one hex encoded PD15 message per line using
+    decode_PD15_hex_messages.  Blank lines are skipped and do not get a
+    status entry.  Compressed files are decompressed on the fly.
+    """
+    with open_binary(path) as f:
+        lines = (line for line in f if line.strip())
+        return decode_PD15_hex_messages(lines, chunk_size, seen, key)
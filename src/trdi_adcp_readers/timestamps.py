@@ -0,0 +1,109 @@
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from trdi_adcp_readers.pd0.pd0_parser import clock_fields, ensemble_clock
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _days_from_civil(year, month, day):
+    """
+    Returns the number of days since 1970-01-01 for a proleptic
+    Gregorian date using integer arithmetic only.
+    """
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = (year_of_era * 365 + year_of_era // 4 -
+                  year_of_era // 100 + day_of_year)
+    return era * 146097 + day_of_era - 719468
+
+
+def _ensemble_clocks(variable_leader):
+    """
+    Yields the ensemble_clock of every ensemble in a variable leader
+    column dictionary
+    """
+    names = [name for name in clock_fields if name in variable_leader]
+    for values in zip(*[variable_leader[name] for name in names]):
+        yield ensemble_clock(dict(zip(names, values)))
+
+
+def decode_timestamps(columns):
+    """
+    Decodes the real time clock of every ensemble in a set of columns
+    (as returned by ensembles_to_columns) at once.
+
+    The clock of each ensemble is read as pd0_parser.ensemble_clock
+    does.
+
+    Returns an array of milliseconds since the Unix epoch (UTC),
+    equivalent to a datetime64[ms] column.
+    """
+    return array('q', [
+        (((_days_from_civil(year, month, day) * 24 + hour) * 60 +
+          minute) * 60 + second) * 1000 + hundredth * 10
+        for year, month, day, hour, minute, second, hundredth in
+        _ensemble_clocks(columns['variable_leader'])
+    ])
+
+
+def timestamps_to_seconds(timestamps):
+    """
+    Converts epoch millisecond timestamps to an array of epoch seconds
+    """
+    return array('d', [timestamp / 1000.0 for timestamp in timestamps])
+
+
+def timestamp_to_datetime(timestamp):
+    """
+    Converts an epoch millisecond timestamp to a naive datetime
+    """
+    return datetime.fromtimestamp(timestamp / 1000.0, timezone.utc).replace(
+        tzinfo=None
+    )
+
+
+def datetime_to_timestamp(value):
+    """
+    Converts a naive (UTC) datetime to epoch milliseconds
+    """
+    delta = value - _EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1000 +
+            delta.microseconds // 1000)
+
+
+def ensemble_counters(columns):
+    """
+    Combines ensemble_roll_over and ensemble_number into a single
+    counter for every ensemble.  The roll over byte counts how many
+    times the 16 bit ensemble number has wrapped, so the combined value
+    keeps increasing across the wrap.
+
+    Returns an array of unsigned 32 bit counters.
+    """
+    variable_leader = columns['variable_leader']
+    return array('L', [
+        (roll_over << 16) | number
+        for roll_over, number in zip(variable_leader['ensemble_roll_over'],
+                                     variable_leader['ensemble_number'])
+    ])
+
+
+def select_time_range(timestamps, start=None, end=None):
+    """
+    Returns the slice of a sorted timestamp array falling within
+    [start, end).  start and end may be datetimes or epoch milliseconds
+    and either may be None for an open range.
+    """
+    if isinstance(start, datetime):
+        start = datetime_to_timestamp(start)
+    if isinstance(end, datetime):
+        end = datetime_to_timestamp(end)
+
+    first = 0 if start is None else bisect_left(timestamps, start)
+    last = len(timestamps) if end is None else bisect_left(timestamps, end)
+    return slice(first, max(first, last))
@@ -1,15 +1,81 @@
 import unittest
+import bz2
+import csv
+import gzip
+import io
+import json
+import logging
+import lzma
+import math
+import multiprocessing
 import os
+import shutil
+import struct
+import tempfile
+from trdi_adcp_readers.pd0.pd0_parser import (
+    diagnostics,
+    parse_pd0_bytearray,
+    parse_variable_leader
+)
+from trdi_adcp_readers.pd0.pd0_encoder import (
+    encode_pd0_ensemble,
+    iter_encode_columns
+)
+from trdi_adcp_readers.pd0.pd0_stream import (
+    iter_ensemble_bytes,
+    raw_ensemble_counter,
+    raw_ensemble_time,
+    scan_ensemble_offsets
+)
+from trdi_adcp_readers.pd15.pd0_converters import (
+    PD0_to_PD15_string,
+    PD15_string_to_PD0
+)
 from trdi_adcp_readers.readers import (
+    iter_PD0_file,
+    read_PD0_bytes,
+    read_PD0_columns,
     read_PD0_file,
     read_PD15_file
 )
+from trdi_adcp_readers.cache import ColumnCache
+from trdi_adcp_readers.pipeline import iter_PD0_file_pipelined
+from trdi_adcp_readers.pyramid import open_pyramid, query_pyramid
+from trdi_adcp_readers.shared import SharedColumns, shared_memory
+from trdi_adcp_readers.stats import RunningStatistics
+from trdi_adcp_readers.subset import subset_PD0_file
+from trdi_adcp_readers.telemetry import (
+    SeenWindow,
+    decode_PD15_hex_messages
+)
+from trdi_adcp_readers.merge import merge_PD0_files
+from trdi_adcp_readers.columnar import ensembles_to_columns, pd0_to_columns
+from trdi_adcp_readers.qc import (
+    apply_qc,
+    build_qc_masks,
+    find_last_good_bins
+)
+from trdi_adcp_readers.scripts.batch_convert_trdi import run_batch
+from trdi_adcp_readers.scripts.convert_trdi import convert_file
+from trdi_adcp_readers.regrid import (
+    bin_depths,
+    bin_ranges,
+    ensemble_depths,
+    regrid_columns
+)
+from trdi_adcp_readers.timestamps import (
+    datetime_to_timestamp,
+    decode_timestamps,
+    ensemble_counters,
+    select_time_range
+)
+from datetime import datetime
 import pprint
 
 
 class TestPD0File(unittest.TestCase):
     test_dir = os.path.dirname(os.path.abspath(__file__))
-    parsed_pd0 = read_PD0_file(os.path.join(test_dir, 'C12AN_90.PD0'))
+    parsed_pd0 = read_PD0_file(os.path.join(test_dir, 'data', 'C12AN_90.PD0'))
 
 #    def test_print_data(self):
 #        pp = pprint.PrettyPrinter(indent=4)
@@ -150,6 +216,568 @@ class TestPD15(unittest.TestCase):
             self.assertEqual(self.parsed_pd0[k]['id'], v)
 
 
+class TestParseDiagnostics(unittest.TestCase):
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def setUp(self):
+        diagnostics.reset()
+        with open(os.path.join(self.test_dir, 'data', 'C12AN_90.PD0'),
+                  'rb') as f:
+            self.pd0_bytes = bytearray(f.read())
+
+    def tearDown(self):
+        diagnostics.reset()
+
+    def test_unknown_block_counted(self):
+        # Relabel the percent good block with an unsupported ID
+        number_of_bytes = struct.unpack_from('<H', self.pd0_bytes, 2)[0]
+        offset = struct.unpack_from('<H', self.pd0_bytes, 6 + 5 * 2)[0]
+        struct.pack_into('<H', self.pd0_bytes, offset, 0x0700)
+        struct.pack_into('<H', self.pd0_bytes, number_of_bytes,
+                         sum(self.pd0_bytes[:number_of_bytes]) & 0xFFFF)
+
+        for i in range(0, 3):
+            data = parse_pd0_bytearray(self.pd0_bytes)
+
+        self.assertNotIn('percent_good', data)
+        self.assertIn('echo_intensity', data)
+        summary = diagnostics.summary()
+        self.assertEqual(summary['unknown_blocks'], {0x0700: 3})
+        self.assertEqual(summary['skipped_bytes'][0x0700],
+                         3 * (number_of_bytes - offset))
+
+        with self.assertLogs('trdi_adcp_readers.pd0.pd0_parser',
+                             'WARNING') as logs:
+            diagnostics.log_summary(logging.WARNING, source='a.PD0')
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('a.PD0: Skipped unknown block 0x0700 3 times',
+                      logs.output[0])
+
+    def test_short_variable_leader(self):
+        # A variable leader that stops before the Y2K clock fields
+        offset = struct.unpack_from('<H', self.pd0_bytes, 8)[0]
+        view = memoryview(self.pd0_bytes)[:offset + 57]
+        data = {}
+        variable_leader = parse_variable_leader(view, offset, data)
+        self.assertNotIn('rtc_y2k_century', variable_leader)
+        self.assertEqual(variable_leader['pressure_variance'], 0)
+        self.assertEqual(data['timestamp'], datetime(2011, 3, 30, 16))
+        self.assertEqual(diagnostics.summary()['field_errors'], {})
+
+
+class TestQC(unittest.TestCase):
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+    parsed_pd0 = read_PD0_file(os.path.join(test_dir, 'data', 'C12AN_90.PD0'))
+
+    def test_columns(self):
+        columns = ensembles_to_columns([self.parsed_pd0, self.parsed_pd0])
+        self.assertEqual(columns['number_of_ensembles'], 2)
+        self.assertEqual(len(columns['velocity']), 2 * 50 * 4)
+        self.assertEqual(list(columns['velocity'][:4]), [99, 130, -65, 20])
+        self.assertEqual(list(columns['variable_leader']['ensemble_number']),
+                         [90, 90])
+
+    def test_masks(self):
+        columns = ensembles_to_columns([self.parsed_pd0, self.parsed_pd0])
+        result = apply_qc(columns, percent_good_minimum=50,
+                          side_lobe=True, boundary_distance=[40, 10])
+        first, second = result['summaries']
+        self.assertEqual(first['bad_velocity'], 1)
+        self.assertEqual(first['low_correlation'], 5)
+        # Earth coordinates test the 3 and 4 beam sums per cell
+        self.assertEqual(first['low_percent_good'], 9 * 4)
+        self.assertEqual(first['side_lobe'], 16 * 4)
+        self.assertEqual(second['side_lobe'], 44 * 4)
+        self.assertEqual(first['good'], 132)
+        # Cell 2 fails the percent good test on every beam
+        self.assertEqual(list(result['velocity'][4:8]), [-32768] * 4)
+        self.assertEqual(list(result['velocity'][8:12]), [132, 85, -33, 41])
+
+        with self.assertRaises(ValueError):
+            apply_qc(columns, side_lobe=True, boundary_distance=[40])
+
+    def test_side_lobe_mixed_configurations(self):
+        # Reconfigured to 5 m blanking and 2 m cells part way through
+        reconfigured = dict(self.parsed_pd0)
+        reconfigured['fixed_leader'] = dict(self.parsed_pd0['fixed_leader'],
+                                            bin_1_distance=500,
+                                            depth_cell_length=200)
+        columns = ensembles_to_columns([self.parsed_pd0, reconfigured])
+        masks = build_qc_masks(columns, side_lobe=True,
+                               boundary_distance=[40, 40])
+        size = 50 * 4
+        self.assertEqual(masks['side_lobe'][:size].count(0), 16 * 4)
+        self.assertEqual(masks['side_lobe'][size:].count(0), 34 * 4)
+
+    def test_last_good_bins(self):
+        other = read_PD0_file(os.path.join(self.test_dir, 'data',
+                                           '1407E0CA.PD0'))
+        columns = ensembles_to_columns([self.parsed_pd0, other])
+        self.assertEqual(list(find_last_good_bins(columns)), [42, 42])
+        self.assertEqual(list(find_last_good_bins(columns, mode='beam')),
+                         [42, 42, 42, 42, 43, 42, 43, 42])
+        self.assertEqual(list(find_last_good_bins(columns, threshold=255)),
+                         [49, 49])
+
+    def test_running_statistics(self):
+        other = read_PD0_file(os.path.join(self.test_dir, 'data',
+                                           '1407E0CA.PD0'))
+        ensembles = [self.parsed_pd0, other, other]
+
+        streamed = RunningStatistics()
+        for ensemble in ensembles:
+            streamed.update(ensemble)
+        batched = RunningStatistics()
+        batched.update_columns(ensembles_to_columns(ensembles[:2]))
+        batched.update_columns(ensembles_to_columns(ensembles[2:]))
+        merged = RunningStatistics()
+        merged.update(self.parsed_pd0)
+        worker = RunningStatistics()
+        worker.update_columns(ensembles_to_columns(ensembles[1:]))
+        merged.merge(worker)
+
+        first = self.parsed_pd0['echo_intensity']['data'][0][0]
+        second = other['echo_intensity']['data'][0][0]
+        mean = (first + 2 * second) / 3.0
+        variance = ((first - mean) ** 2 + 2 * (second - mean) ** 2) / 3
+        for statistics in (streamed, batched, merged):
+            summary = statistics.summary()['echo_intensity']
+            self.assertEqual(summary['count'][0], 3)
+            self.assertAlmostEqual(summary['mean'][0], mean)
+            self.assertAlmostEqual(summary['variance'][0], variance)
+            self.assertEqual(summary['minimum'][0], min(first, second))
+            self.assertEqual(summary['maximum'][0], max(first, second))
+            self.assertEqual(sum(summary['histogram'][:64]), 3)
+            self.assertEqual(summary['histogram'][first // 4], 1 +
+                             2 * (first // 4 == second // 4))
+
+        # The bad velocity in the first ensemble is not counted
+        velocity = streamed.summary()['velocity']
+        self.assertEqual(sum(velocity['count']), 3 * 200 - 1)
+        self.assertEqual(list(batched.summary()['velocity']['count']),
+                         list(velocity['count']))
+
+    def test_regrid(self):
+        columns = ensembles_to_columns([self.parsed_pd0, self.parsed_pd0])
+        echo = self.parsed_pd0['echo_intensity']['data']
+        # Transducer at 1 m, first bin 2.73 m below it, 1 m cells
+        result = regrid_columns(columns, [0.5, 3.73, 4.23, 100],
+                                keys=['echo_intensity'],
+                                tilt_correction=False)
+        regridded = result['echo_intensity']
+        self.assertEqual(len(regridded), 2 * 4 * 4)
+        self.assertTrue(all(math.isnan(value) for value in regridded[:4]))
+        self.assertEqual(list(regridded[4:8]), echo[0])
+        self.assertEqual([round(value, 9) for value in regridded[8:12]],
+                         [(a + b) / 2.0 for a, b in zip(echo[0], echo[1])])
+        self.assertEqual(list(regridded[20:28]), list(regridded[4:12]))
+
+        # Ensembles sharing a configuration share one cached range vector
+        self.assertIs(bin_ranges(50, 273, 100), bin_ranges(50, 273, 100))
+        tilted = bin_depths(50, 273, 100, 10, -89, -92)
+        self.assertLess(tilted[1], 4.73)
+        tilted_columns = ensembles_to_columns([self.parsed_pd0])
+        self.assertEqual(ensemble_depths(tilted_columns), [tilted])
+        self.assertAlmostEqual(bin_depths(50, 273, 100, 10, upward=True)[0],
+                               -1.73)
+
+    def test_mixed_configurations(self):
+        # Ensemble after a reconfiguration to 5 m blanking and 2 m cells
+        reconfigured = dict(self.parsed_pd0)
+        reconfigured['fixed_leader'] = dict(self.parsed_pd0['fixed_leader'],
+                                            bin_1_distance=500,
+                                            depth_cell_length=200)
+        columns = ensembles_to_columns([self.parsed_pd0, reconfigured])
+        self.assertEqual(list(columns['configuration']['bin_1_distance']),
+                         [273, 500])
+        decoded = pd0_to_columns(iter_encode_columns(columns))
+        self.assertEqual(list(decoded['configuration']['depth_cell_length']),
+                         [100, 200])
+
+        depths = ensemble_depths(decoded, tilt_correction=False)
+        self.assertEqual([round(depth, 2) for depth in depths[0][:2]],
+                         [3.73, 4.73])
+        self.assertEqual(depths[1][:2], (6.0, 8.0))
+
+        echo = reconfigured['echo_intensity']['data']
+        result = regrid_columns(decoded, [3.73, 6.0],
+                                keys=['echo_intensity'],
+                                tilt_correction=False)
+        self.assertEqual(list(result['echo_intensity'][12:16]), echo[0])
+        self.assertTrue(all(math.isnan(value)
+                            for value in result['echo_intensity'][8:12]))
+
+
+class TestTimestamps(unittest.TestCase):
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+    first = read_PD0_file(os.path.join(test_dir, 'data', 'C12AN_90.PD0'))
+    second = read_PD0_file(os.path.join(test_dir, 'data', '1407E0CA.PD0'))
+
+    def test_parsed_timestamp(self):
+        self.assertEqual(self.second['timestamp'],
+                         datetime(2025, 5, 28, 12, 19, 28, 130000))
+
+    def test_decode_timestamps(self):
+        columns = ensembles_to_columns([self.first, self.second])
+        timestamps = decode_timestamps(columns)
+        self.assertEqual(list(timestamps), [
+            datetime_to_timestamp(self.first['timestamp']),
+            datetime_to_timestamp(self.second['timestamp'])
+        ])
+        self.assertEqual(select_time_range(timestamps,
+                                           datetime(2012, 1, 1)),
+                         slice(1, 2))
+
+    def test_ensemble_counters(self):
+        rolled = dict(self.second)
+        rolled['variable_leader'] = dict(self.second['variable_leader'],
+                                         ensemble_roll_over=1,
+                                         ensemble_number=3)
+        columns = ensembles_to_columns([self.second, rolled])
+        self.assertEqual(list(ensemble_counters(columns)), [172, 65539])
+
+
+def sum_shared_velocity(descriptor, results):
+    with SharedColumns.attach(descriptor) as shared:
+        results.put(sum(shared.columns['velocity']))
+
+
+class TestEnsembleStreams(unittest.TestCase):
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def setUp(self):
+        with open(os.path.join(self.test_dir, 'data', 'C12AN_90.PD0'),
+                  'rb') as f:
+            self.first = f.read()
+        with open(os.path.join(self.test_dir, 'data', '1407E0CA.PD0'),
+                  'rb') as f:
+            self.second = f.read()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, name, contents):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return path
+
+    def test_scan(self):
+        # Garbage and a corrupt header between valid ensembles
+        pd0_bytes = b'junk\x7f\x7f\xff\xff' + self.first + self.second
+        self.assertEqual(scan_ensemble_offsets(pd0_bytes),
+                         [(8, 1154), (1162, 1154)])
+        for chunk_size in (7, 65536):
+            ensembles = list(iter_ensemble_bytes(io.BytesIO(pd0_bytes),
+                                                 chunk_size))
+            self.assertEqual(ensembles, [self.first[:1154],
+                                         self.second[:1154]])
+
+    def test_raw_fields(self):
+        for pd0_bytes in (self.first, self.second):
+            data = read_PD0_bytes(pd0_bytes)
+            self.assertEqual(raw_ensemble_time(pd0_bytes), data['timestamp'])
+            self.assertEqual(raw_ensemble_counter(pd0_bytes),
+                             data['variable_leader']['ensemble_number'])
+
+    def test_merge(self):
+        paths = [
+            self.write_file('b.PD0', self.second),
+            self.write_file('ab.PD0', self.first + self.second)
+        ]
+        merged = list(merge_PD0_files(paths))
+        self.assertEqual([data['variable_leader']['ensemble_number']
+                          for data in merged], [90, 172])
+        merged = list(merge_PD0_files(paths, key='ensemble',
+                                      deduplicate=False))
+        self.assertEqual([data['variable_leader']['ensemble_number']
+                          for data in merged], [90, 172, 172])
+
+    def test_compressed(self):
+        for compress in (gzip.compress, bz2.compress, lzma.compress):
+            path = self.write_file('ab.PD0.z',
+                                   compress(self.first + self.second))
+            ensembles = list(iter_PD0_file(path))
+            self.assertEqual(len(ensembles), 2)
+            self.assertEqual(ensembles[1]['variable_leader']['ensemble_number'],
+                             172)
+
+        with open(os.path.join(self.test_dir, '140B97C6'), 'rb') as f:
+            pd15 = f.read()
+        compressed = io.BytesIO(gzip.compress(pd15))
+        self.assertEqual(read_PD15_file(compressed, header_lines=2)['header'],
+                         read_PD15_file(io.BytesIO(pd15),
+                                        header_lines=2)['header'])
+
+    def test_column_cache(self):
+        path = self.write_file('ab.PD0', self.first + self.second)
+        parsed = ensembles_to_columns(iter_PD0_file(path))
+        self.assertEqual(read_PD0_columns(path), parsed)
+
+        cache = ColumnCache(os.path.join(self.temp_dir, 'cache'))
+        decoded = read_PD0_columns(path, cache=cache)
+        self.assertEqual(len(cache.entries()), 1)
+        # No temporary files are left behind
+        self.assertEqual(len(os.listdir(cache.cache_dir)), 1)
+        cached = read_PD0_columns(path, cache=cache)
+        self.assertIsInstance(cached['velocity'], memoryview)
+        self.assertEqual(cached['fixed_leader'], decoded['fixed_leader'])
+        self.assertEqual(list(cached['velocity']), list(decoded['velocity']))
+        self.assertEqual(
+            list(cached['variable_leader']['ensemble_number']), [90, 172]
+        )
+
+        # Truncated entries and headers without a byte order are decoded
+        # again instead of raising
+        entry_path = cache.entry_path(cache.key(path))
+        header = json.dumps({'size': 0, 'arrays': []}).encode('utf-8')
+        for contents in (b'TRDC\x01',
+                         b'TRDC' + struct.pack('<I', len(header)) + header):
+            with open(entry_path, 'wb') as f:
+                f.write(contents)
+            self.assertIsNone(cache.load(cache.key(path)))
+            self.assertFalse(os.path.exists(entry_path))
+        read_PD0_columns(path, cache=cache)
+
+        # Temporary files of a killed writer are removed once stale
+        stale = os.path.join(cache.cache_dir, 'killed.tmp')
+        with open(stale, 'wb') as f:
+            f.write(b'partial')
+        cache.evict()
+        self.assertTrue(os.path.exists(stale))
+        os.utime(stale, (0, 0))
+        cache.evict()
+        self.assertFalse(os.path.exists(stale))
+
+        cache.max_size = 0
+        cache.evict()
+        self.assertEqual(cache.entries(), [])
+
+    def test_pipelined(self):
+        path = self.write_file('ab.PD0', (self.first + self.second) * 20)
+        pipelined = list(iter_PD0_file_pipelined(path, chunk_size=100,
+                                                 memory_budget=300))
+        self.assertEqual(pipelined, list(iter_PD0_file(path)))
+
+        # Stopping early must not leave the reader thread blocked
+        for data in iter_PD0_file_pipelined(path, chunk_size=100,
+                                            memory_budget=100):
+            break
+
+    @unittest.skipUnless(shared_memory, 'Requires Python 3.8 or newer')
+    def test_shared_columns(self):
+        path = self.write_file('ab.PD0', self.first + self.second)
+        columns = read_PD0_columns(path)
+        shared = SharedColumns.create(columns)
+        try:
+            self.assertEqual(list(shared.columns['velocity']),
+                             list(columns['velocity']))
+            results = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=sum_shared_velocity,
+                args=(shared.descriptor, results)
+            )
+            worker.start()
+            worker.join()
+            self.assertEqual(results.get(timeout=10),
+                             sum(columns['velocity']))
+        finally:
+            shared.close()
+            shared.unlink()
+
+    def test_subset(self):
+        path = self.write_file('ab.PD0', self.first + self.second)
+        output = os.path.join(self.temp_dir, 'subset.PD0')
+        count = subset_PD0_file(path, output,
+                                start_time=datetime(2012, 1, 1))
+        self.assertEqual(count, 1)
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), self.second[:1154])
+
+        count = subset_PD0_file(path, output, last_ensemble=100,
+                                max_cells=5)
+        self.assertEqual(count, 1)
+        subset = read_PD0_file(output)
+        original = read_PD0_file(path)
+        self.assertEqual(subset['fixed_leader']['number_of_cells'], 5)
+        self.assertEqual(subset['header']['number_of_bytes'],
+                         original['header']['number_of_bytes'] - 45 * 4 * 5)
+        for key in ('velocity', 'correlation', 'echo_intensity',
+                    'percent_good'):
+            self.assertEqual(subset[key]['data'], original[key]['data'][:5])
+        self.assertEqual(subset['variable_leader'],
+                         original['variable_leader'])
+
+    def test_pyramid(self):
+        path = self.write_file('deployment.PD0',
+                               self.first[:1154] * 10 + self.second * 14)
+        pyramid = open_pyramid(path, factors=(4, 16))
+        self.assertTrue(os.path.exists(path + '.pyramid'))
+        self.assertEqual([(level['factor'], level['number_of_bins'])
+                          for level in pyramid['levels']],
+                         [(4, 6), (16, 2)])
+        self.assertEqual(list(pyramid['levels'][1]['ensembles']), [16, 8])
+
+        first = read_PD0_file(path)['echo_intensity']['data'][0][0]
+        second = read_PD0_bytes(self.second)['echo_intensity']['data'][0][0]
+        # The first coarse bin holds 10 ensembles of one file, 6 of the other
+        level = pyramid['levels'][1]['echo_intensity']
+        self.assertAlmostEqual(level['mean'][0],
+                               (10 * first + 6 * second) / 16)
+        self.assertEqual(level['minimum'][0], min(first, second))
+        self.assertEqual(level['maximum'][0], max(first, second))
+
+        result = query_pyramid(pyramid, pixels=5)
+        self.assertEqual((result['factor'], result['number_of_bins']), (4, 6))
+        result = query_pyramid(pyramid, start=datetime(2020, 1, 1), pixels=3)
+        self.assertEqual((result['factor'], result['number_of_bins']), (4, 3))
+        self.assertEqual(list(result['echo_intensity']['mean'][:1]), [second])
+        # Too few bins, full resolution is read from the file instead
+        self.assertIsNone(query_pyramid(pyramid, start=datetime(2020, 1, 1),
+                                        pixels=5))
+
+        # Other options rebuild the stored pyramid
+        pyramid = open_pyramid(path, factors=(8,), keys=['echo_intensity'])
+        self.assertEqual([(level['factor'], level['number_of_bins'])
+                          for level in pyramid['levels']], [(8, 3)])
+        self.assertRaises(ValueError, open_pyramid, path, factors=(1, 4))
+
+    def test_batch_convert(self):
+        input_dir = os.path.join(self.temp_dir, 'inputs')
+        output_dir = os.path.join(self.temp_dir, 'outputs')
+        os.makedirs(input_dir)
+        first = self.write_file(os.path.join('inputs', 'a.PD0'), self.first)
+        self.write_file(os.path.join('inputs', 'b.pd0.gz'),
+                        gzip.compress(self.second))
+        self.write_file(os.path.join('inputs', 'notes.txt'), b'')
+
+        result = run_batch([input_dir], output_dir, workers=2,
+                           progress=None)
+        self.assertEqual(len(result['converted']), 2)
+        self.assertEqual(result['failed'], [])
+        self.assertEqual(sorted(os.listdir(output_dir)),
+                         ['.trdi_manifest.jsonl', 'a.PD0.txt', 'b.pd0.txt'])
+        with open(os.path.join(output_dir, 'b.pd0.txt')) as f:
+            self.assertIn("'ensemble_number': 172", f.read())
+
+        # Unchanged (even if touched) inputs are skipped on the next run
+        os.utime(first, ns=(0, 0))
+        result = run_batch([os.path.join(input_dir, '*')], output_dir,
+                           workers=1, progress=None)
+        self.assertEqual(len(result['skipped']), 2)
+        self.assertEqual(result['converted'] + result['failed'], [])
+
+        self.write_file(os.path.join('inputs', 'a.PD0'), self.second)
+        result = run_batch([input_dir], output_dir, workers=1,
+                           progress=None)
+        self.assertEqual(result['converted'], [first])
+
+    def test_streaming_output(self):
+        path = self.write_file('ab.PD0', self.first + self.second)
+        output = io.StringIO()
+        convert_file(path, output, output_format='jsonl')
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        ensemble = json.loads(lines[1])
+        self.assertEqual(ensemble['timestamp'], '2025-05-28T12:19:28.130000')
+        self.assertEqual(ensemble['velocity']['data'],
+                         read_PD0_bytes(self.second)['velocity']['data'])
+
+        output = io.StringIO()
+        convert_file(path, output, output_format='csv', block='velocity')
+        rows = output.getvalue().splitlines()
+        self.assertEqual(len(rows), 1 + 2 * 50)
+        self.assertEqual(rows[0], 'ensemble_number,timestamp,cell,' +
+                         'beam_1,beam_2,beam_3,beam_4')
+        self.assertEqual(rows[1], '90,2011-03-30T16:00:00,1,99,130,-65,20')
+
+        output = io.StringIO()
+        convert_file(path, output, output_format='csv',
+                     block='variable_leader')
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual([row['ensemble_number'] for row in rows],
+                         ['90', '172'])
+        self.assertEqual(rows[1]['pressure'], '3390')
+
+
+class TestEncoders(unittest.TestCase):
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def setUp(self):
+        with open(os.path.join(self.test_dir, 'data', '1407E0CA.PD0'),
+                  'rb') as f:
+            self.pd0_bytes = f.read()[:1154]
+        with open(os.path.join(self.test_dir, 'data', '1407E0CA.PD15'),
+                  'rb') as f:
+            self.pd15_line = f.read().split(b'\n')[2]
+
+    def test_encode_pd0(self):
+        data = read_PD0_bytes(bytearray(self.pd0_bytes))
+        encoded = encode_pd0_ensemble(data)
+        self.assertEqual(len(encoded), len(self.pd0_bytes))
+        self.assertEqual(read_PD0_bytes(encoded), data)
+
+        columns = ensembles_to_columns([data, data])
+        self.assertEqual(list(iter_encode_columns(columns)),
+                         [encoded, encoded])
+
+    def test_pd15_round_trip(self):
+        pd15 = PD0_to_PD15_string(self.pd0_bytes)
+        self.assertEqual(pd15, self.pd15_line[:len(pd15)])
+        pd0 = PD15_string_to_PD0(pd15)
+        self.assertEqual(pd0[:len(self.pd0_bytes)], self.pd0_bytes)
+
+    def test_hex_messages(self):
+        first = self.pd15_line.hex()
+        with open(os.path.join(self.test_dir, '140B97C6'), 'rb') as f:
+            second = f.read().split(b'\n')[2].hex()
+        # Change one 6 bit character so the checksum no longer matches
+        corrupt = first[:200] + '41' + first[202:]
+        self.assertNotEqual(first[200:202], '41')
+
+        result = decode_PD15_hex_messages(
+            [first, second, 'zz', first, corrupt], chunk_size=2
+        )
+        status = result['status']
+        self.assertEqual(status[:2] + status[3:4], [None, None, None])
+        self.assertIn('hexadecimal', status[2])
+        self.assertIn('Calculated', status[4])
+
+        groups = result['groups']
+        self.assertEqual([list(group['indexes']) for group in groups],
+                         [[0, 3], [1]])
+        columns = groups[0]['columns']
+        self.assertEqual(columns['number_of_ensembles'], 2)
+        self.assertEqual(
+            list(columns['velocity'][:200]),
+            [value for cell in
+             read_PD0_bytes(bytearray(self.pd0_bytes))['velocity']['data']
+             for value in cell]
+        )
+
+    def test_duplicate_messages(self):
+        first = self.pd15_line.hex()
+        # The same ensemble relayed with extra padding characters
+        padded = first + b'@@@@'.hex()
+        seen = SeenWindow(window=60, clock=lambda: 0)
+        result = decode_PD15_hex_messages([first, padded, first], seen=seen)
+        self.assertEqual(result['status'],
+                         [None, 'Duplicate message', 'Duplicate message'])
+        self.assertEqual(list(result['groups'][0]['indexes']), [0])
+        self.assertEqual(seen.duplicates, 2)
+
+        # Keys are forgotten once they fall out of the window
+        seen = SeenWindow(window=60, max_entries=2)
+        self.assertFalse(seen.check(b'a', now=0))
+        self.assertTrue(seen.check(b'a', now=30))
+        self.assertFalse(seen.check(b'a', now=61))
+        seen.check(b'b', now=62)
+        seen.check(b'c', now=63)
+        self.assertEqual(len(seen), 2)
+        self.assertFalse(seen.check(b'a', now=64))
+
+
 #class TestPD15String(unittest.TestCase):
 #    pd15_hex = "f114f014f112f909f40cf30df40df30cf50cf60bf50afb03f90af906fb04f0f2f113f013f213f40df50ef50ef30df40cf60bf50d0001f905fa09f907f904f1eb000000000000000000000000000000007373777005390703180000000000fdd3"  # NOQA
 #